@@ -0,0 +1,87 @@
+"""dict-by-dict aggregation of the groupings against the weight matrices
+
+python -m benchmarks.bench_aggregation [--funds 5000] [--categories 40]
+
+Builds random groupings for the given number of funds, aggregates them both ways into
+the basis-point assignments of a taxonomy, checks that they agree and times the
+portfolio look-through exposure of the matrices.
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from src.components.holdings import Security, SecurityHoldingReport
+from src.components.weights import WeightMatrix
+
+KIND = 'Sector'
+
+
+def make_securities(funds, categories, per_fund):
+    random.seed(funds)
+    names = [f"Category {idx}" for idx in range(categories)]
+    securities = []
+    for _ in range(funds):
+        report = SecurityHoldingReport('de')
+        report.grouping = {KIND: {name: random.uniform(0, 100 / per_fund) for name in random.sample(names, per_fund)}}
+        report.long_equity = random.uniform(0.5, 1)
+        security = Security(ISIN=None)
+        security.holdings = report
+        securities.append(security)
+    return securities
+
+
+def dict_aggregate(securities):
+    """the aggregation as it was done before the matrices: scale, then collect every assignment"""
+    unique_categories = defaultdict(list)
+    for row, security in enumerate(securities):
+        long_equity = security.holdings.long_equity
+        scaled = {k: v * long_equity for k, v in security.holdings.grouping[KIND].items()}
+        for category, weight in scaled.items():
+            unique_categories[category].append((row, round(weight * 100)))
+    return {category: (assignments, sum(weight for _, weight in assignments))
+            for category, assignments in unique_categories.items()}
+
+
+def matrix_aggregate(securities):
+    matrix = WeightMatrix.from_securities(KIND, securities)
+    aggregated = dict()
+    for category, rows, weights, _ in matrix.assignments():
+        aggregated[category] = (list(zip(rows, weights)), sum(weights))
+    return matrix, aggregated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the aggregation of the fund groupings')
+    parser.add_argument('--funds', default=5000, type=int, help='number of funds')
+    parser.add_argument('--categories', default=40, type=int, help='size of the category vocabulary')
+    parser.add_argument('--per-fund', default=12, type=int, help='categories reported by every fund')
+    args = parser.parse_args()
+
+    securities = make_securities(args.funds, args.categories, args.per_fund)
+
+    start = time.perf_counter()
+    expected = dict_aggregate(securities)
+    dict_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix, aggregated = matrix_aggregate(securities)
+    matrix_time = time.perf_counter() - start
+    assert aggregated == expected
+
+    values = np.random.default_rng(args.funds).uniform(1000, 100000, args.funds)
+    start = time.perf_counter()
+    matrix.exposure(values)
+    exposure_time = time.perf_counter() - start
+
+    print(f"funds x categories:  {args.funds} x {len(matrix.categories)}")
+    print(f"dict aggregation:    {dict_time * 1000:8.2f} ms")
+    print(f"matrix aggregation:  {matrix_time * 1000:8.2f} ms")
+    print(f"speedup:             {dict_time / matrix_time:8.1f}x")
+    print(f"look-through totals: {exposure_time * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
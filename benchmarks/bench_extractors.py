@@ -0,0 +1,87 @@
+"""per-call jsonpath parsing against the precompiled taxonomy extractors
+
+python -m benchmarks.bench_extractors [--rounds 200]
+
+Runs both over the SAL responses in benchmarks/fixtures/sal and checks that they agree.
+"""
+import argparse
+import json
+import os
+import time
+
+from jsonpath_ng import parse
+
+from src.components.extractors import compile_taxonomies
+from src.utils.taxonomies import taxonomies
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'sal')
+NON_CATEGORIES = ['avgMarketCap', 'portfolioDate', 'name', 'masterPortfolioId']
+
+
+def load_responses():
+    responses = dict()
+    for name in taxonomies:
+        with open(os.path.join(FIXTURES, name.lower() + '.json')) as f:
+            responses[name] = json.load(f)
+    return responses
+
+
+def per_call_extract(taxonomy, response):
+    """the extraction as it was done before the extractors: parse and find on every call"""
+    jsonpath = parse(taxonomy['jsonpath'])
+    percent_field = taxonomy['percent']
+    percentages = []
+    if len(jsonpath.find(response)) == 1:
+        value = jsonpath.find(response)[0].value
+        keys = [key for key in value if key not in NON_CATEGORIES]
+        if percent_field != "":
+            percentages = [float(value[key][percent_field]) for key in keys]
+        else:
+            percentages = [float(value[key]) for key in keys]
+    else:
+        value = jsonpath.find(response)
+        keys = [key.value[taxonomy['category']] for key in value]
+        percentages = [float(key.value[taxonomy['percent']]) for key in value]
+    if len(taxonomy.get('map', {})) != 0:
+        categories = [taxonomy['map'][key] for key in keys if key in taxonomy['map'].keys()]
+    else:
+        categories = [key[0].upper() + key[1:] for key in keys]
+    return categories, percentages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the taxonomy extraction of SAL responses')
+    parser.add_argument('--rounds', default=200, type=int, help='times every response is extracted')
+    args = parser.parse_args()
+
+    responses = load_responses()
+    start = time.perf_counter()
+    extractors = compile_taxonomies(taxonomies)
+    compile_time = time.perf_counter() - start
+
+    for name, response in responses.items():
+        extraction = extractors[name].extract(response)
+        expected = per_call_extract(taxonomies[name], response)
+        assert (extraction.categories, extraction.percentages) == expected, name
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for name, response in responses.items():
+            per_call_extract(taxonomies[name], response)
+    per_call_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for name, response in responses.items():
+            extractors[name].extract(response)
+    extractor_time = time.perf_counter() - start
+
+    calls = args.rounds * len(responses)
+    print(f"compile once:        {compile_time * 1000:8.2f} ms")
+    print(f"per-call jsonpath:   {per_call_time / calls * 1e6:8.1f} us per response")
+    print(f"compiled extractors: {extractor_time / calls * 1e6:8.1f} us per response")
+    print(f"speedup:             {per_call_time / extractor_time:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""memory held by the securities and their groupings, compact layout against the dict one
+
+python -m benchmarks.bench_memory [--funds 5000] [--holdings 25]
+
+Builds the given number of funds with every taxonomy loaded, the groupings decoded from
+json as they are read from the classification store, once in the layout used before the
+slots (securities and reports with a __dict__, a defaultdict of float per grouping with
+its own copy of every category name) and once as Security, SecurityHoldingReport and
+Grouping. Reports the memory allocated by each (tracemalloc) and checks that they agree.
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+
+from src.components.grouping import freeze_groupings
+from src.components.holdings import Security, SecurityHoldingReport
+from src.utils.taxonomies import taxonomies
+
+
+class DictSecurity:
+    """Security as it was: its fields in a __dict__"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+        self.holdings = None
+
+
+class DictHoldingReport:
+    """SecurityHoldingReport as it was: a __dict__ and a defaultdict per grouping"""
+
+    def __init__(self, domain):
+        self.isin = None
+        self.secid = ''
+        self.secid_type = None
+        self.secid_domain = None
+        self.domain = domain
+        self.portfolio_date = None
+        self.grouping = dict()
+        self.long_equity = None
+        self.funds = None
+        self.expanded = dict()
+        self.stale = False
+
+
+def get_vocabularies(holdings):
+    """category names of every kind; the holdings are drawn from a pool of stocks"""
+    vocabularies = dict()
+    for kind, taxonomy in taxonomies.items():
+        names = sorted(set(taxonomy.get('map', {}).values())) or [f"{kind} {idx}" for idx in range(12)]
+        vocabularies[kind] = names
+    vocabularies['Holding'] = [f"Stock Corporation {idx}" for idx in range(holdings * 40)]
+    return vocabularies
+
+
+def make_payloads(funds, holdings):
+    """the stored groupings of every fund, as json"""
+    random.seed(funds)
+    vocabularies = get_vocabularies(holdings)
+    payloads = []
+    for _ in range(funds):
+        grouping = dict()
+        for kind, names in vocabularies.items():
+            size = holdings if kind == 'Holding' else max(1, len(names) * 3 // 4)
+            grouping[kind] = {name: random.uniform(0, 100 / size) for name in random.sample(names, size)}
+        payloads.append(json.dumps(grouping))
+    return payloads
+
+
+def build_dict_layout(payloads):
+    securities = []
+    for idx, payload in enumerate(payloads):
+        report = DictHoldingReport('de')
+        report.secid = f"F{idx:09d}"
+        for kind, grouping in json.loads(payload).items():
+            report.grouping[kind] = defaultdict(float, grouping)
+        report.long_equity = 0.9
+        security = DictSecurity(name=f"Fund {idx}", ISIN=f"XX{idx:010d}", secid=None, UUID=None, transactions=1,
+                                shares=10)
+        security.holdings = report
+        securities.append(security)
+    return securities
+
+
+def build_compact_layout(payloads):
+    securities = []
+    for idx, payload in enumerate(payloads):
+        report = SecurityHoldingReport('de')
+        report.secid = f"F{idx:09d}"
+        report.grouping = freeze_groupings(json.loads(payload))
+        report.long_equity = 0.9
+        security = Security(name=f"Fund {idx}", ISIN=f"XX{idx:010d}", secid=None, UUID=None, transactions=1,
+                            shares=10)
+        security.holdings = report
+        securities.append(security)
+    return securities
+
+
+def measure(build, payloads):
+    """(securities, bytes allocated by them, seconds to build them)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    securities = build(payloads)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return securities, allocated, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the memory held by the fund groupings')
+    parser.add_argument('--funds', default=5000, type=int, help='number of funds')
+    parser.add_argument('--holdings', default=25, type=int, help='top holdings reported by every fund')
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.funds, args.holdings)
+    dict_securities, dict_bytes, dict_time = measure(build_dict_layout, payloads)
+    compact_securities, compact_bytes, compact_time = measure(build_compact_layout, payloads)
+    for dict_security, compact_security in zip(dict_securities, compact_securities):
+        for kind, grouping in dict_security.holdings.grouping.items():
+            assert dict(compact_security.holdings.grouping[kind].items()) == grouping
+
+    weights = sum(len(grouping) for security in compact_securities for grouping in security.holdings.grouping.values())
+    print(f"funds:               {args.funds} ({weights} weights)")
+    print(f"dict layout:         {dict_bytes / 2 ** 20:8.1f} MiB, {dict_bytes / args.funds:8.0f} B per fund, "
+          f"built in {dict_time * 1000:7.1f} ms")
+    print(f"compact layout:      {compact_bytes / 2 ** 20:8.1f} MiB, {compact_bytes / args.funds:8.0f} B per fund, "
+          f"built in {compact_time * 1000:7.1f} ms")
+    print(f"reduction:           {dict_bytes / compact_bytes:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
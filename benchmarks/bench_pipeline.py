@@ -0,0 +1,114 @@
+"""offline benchmark of the whole classification, phase by phase
+
+python -m benchmarks.bench_pipeline [--sizes 10,100,1000,10000] [--latency 0.05] [--workers 8]
+python -m benchmarks.bench_pipeline --input my_portfolio.xml --replay recordings/ [--latency 0.05]
+
+Without --replay the morningstar responses are synthetic (benchmarks/synthetic.py), with
+--replay they come from a directory recorded with `src/app.py --record`. Every size runs in
+its own interpreter and reports, for each phase, the wall time, the requests made and the
+peak rss of the process at the end of the phase.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import write_pp_file, SyntheticBackend
+
+PHASES = ['load', 'fetch', 'classify', 'write']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_size(input_file, args):
+    from src.components.classifier import PortfolioPerformanceFile
+    from src.components.replay import ReplayBackend
+    from src.components.streaming import StreamingPortfolioPerformanceFile
+    from src.components.transport import Transport
+    from src.utils.taxonomies import taxonomies
+
+    if args.replay:
+        backend = ReplayBackend(args.replay, latency=args.latency)
+    else:
+        backend = SyntheticBackend(latency=args.latency, xray_every=args.xray_every)
+    Transport.configure(concurrency=args.host_concurrency, rate_limit=0, backend=backend)
+    file_class = StreamingPortfolioPerformanceFile if args.stream else PortfolioPerformanceFile
+
+    report = dict()
+    state = dict()
+
+    def load():
+        state['pp_file'] = file_class(input_file, args.domain, args.workers)
+
+    def fetch():
+        state['pp_file'].get_securities()
+
+    def classify():
+        for taxonomy in taxonomies:
+            state['pp_file'].add_taxonomy(taxonomy)
+
+    def write():
+        state['pp_file'].write_xml(input_file + '.out')
+
+    for name, phase in zip(PHASES, (load, fetch, classify, write)):
+        requests_before = Transport.requests_made
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            phase()
+        report[name] = {'seconds': round(time.perf_counter() - start, 4),
+                        'requests': Transport.requests_made - requests_before,
+                        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    report['securities'] = len(state['pp_file'].get_securities())
+    print(json.dumps(report))
+
+
+def print_report(size, report):
+    for name in PHASES:
+        phase = report[name]
+        print(f"{size:>8} {name:<9} {phase['seconds']:>10.3f} {phase['requests']:>9} {phase['peak_rss_mb']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline benchmark of the classification phases')
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated numbers of securities')
+    parser.add_argument('--input', help='classify this pp file instead of synthetic ones')
+    parser.add_argument('--replay', metavar='DIR', help='replay the responses recorded in DIR')
+    parser.add_argument('--latency', default=0.0, type=float, help='seconds added to every response')
+    parser.add_argument('--xray-every', default=10, type=int,
+                        help='every n-th synthetic fund gets its data from x-ray (0: none)')
+    parser.add_argument('--workers', default=8, type=int, help='securities fetched in parallel')
+    parser.add_argument('--host-concurrency', default=8, type=int, help='simultaneous requests per host')
+    parser.add_argument('--domain', default='de', help='morningstar domain')
+    parser.add_argument('--stream', action='store_true', help='use the streaming xml path')
+    parser.add_argument('--run-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_file:
+        run_size(args.run_file, args)
+        return
+
+    forwarded = sys.argv[1:]
+    print(f"{'size':>8} {'phase':<9} {'seconds':>10} {'requests':>9} {'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.input:
+            inputs = [(os.path.basename(args.input), args.input)]
+        else:
+            inputs = []
+            for size in (int(size) for size in args.sizes.split(',')):
+                input_file = os.path.join(tmp, f'synthetic-{size}.xml')
+                write_pp_file(input_file, securities=size, prices_per_security=20, transactions_per_security=2)
+                inputs.append((size, input_file))
+        for size, input_file in inputs:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_pipeline', *forwarded,
+                                     '--run-file', input_file], check=True, capture_output=True, text=True,
+                                    cwd=ROOT).stdout
+            print_report(size, json.loads(output.strip().splitlines()[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""start-up time of the command line
+
+python -m benchmarks.bench_startup [--runs 20] [--imports 10]
+
+Starts `src/app.py --help` the given number of times, each in a fresh interpreter, and
+reports the median and best wall time next to a bare interpreter start, then lists the
+slowest modules imported on the way (python -X importtime).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_command(command, runs, cwd, env):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def slowest_imports(command, cwd, env, count):
+    """(cumulated microseconds, module) of the slowest imports of the command"""
+    result = subprocess.run(command[:1] + ['-X', 'importtime'] + command[1:], cwd=cwd, env=env, check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imports.append((int(fields[1]), fields[2].rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the start-up of the command line')
+    parser.add_argument('--runs', default=20, type=int, help='starts of each command')
+    parser.add_argument('--imports', default=10, type=int, help='slowest imports listed')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    with tempfile.TemporaryDirectory() as directory:
+        # the app logs to _tmp/app.log of the working directory
+        os.mkdir(os.path.join(directory, '_tmp'))
+        interpreter = time_command([sys.executable, '-c', 'pass'], args.runs, directory, env)
+        app_command = [sys.executable, '-m', 'src.app', '--help']
+        app = time_command(app_command, args.runs, directory, env)
+        imports = slowest_imports(app_command, directory, env, args.imports)
+
+    print(f"python -c pass:      median {statistics.median(interpreter) * 1000:7.1f} ms, "
+          f"best {min(interpreter) * 1000:7.1f} ms")
+    print(f"src.app --help:      median {statistics.median(app) * 1000:7.1f} ms, best {min(app) * 1000:7.1f} ms")
+    print("slowest imports (cumulated):")
+    for microseconds, module in imports:
+        print(f"  {microseconds / 1000:8.1f} ms {module}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""wall time and peak memory of the in-memory and the streaming xml path
+
+python -m benchmarks.bench_streaming [--size-mb 500] [--securities 200] [--zipped]
+
+Each mode runs in its own interpreter so that the peak rss of one does not hide the other.
+With --zipped both modes run again on the file zipped as portfolio performance saves it.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from xml.etree import ElementTree as ET
+
+from benchmarks.synthetic import write_pp_file_of_size
+from src.components.file_format import ZIP_ENTRY
+
+
+def build_taxonomy(pp_file, securities):
+    taxonomy = ET.Element('taxonomy')
+    ET.SubElement(taxonomy, 'name').text = 'benchmark'
+    assignments = ET.SubElement(taxonomy, 'assignments')
+    for security in securities:
+        assignment = ET.SubElement(assignments, 'assignment')
+        ET.SubElement(assignment, 'investmentVehicle', {
+            'class': 'security', 'reference': pp_file.get_security_xpath_by_uuid(security.UUID)})
+    return taxonomy
+
+
+def run_mode(mode, input_file, output_file):
+    from src.components.classifier import PortfolioPerformanceFile
+    from src.components.streaming import StreamingPortfolioPerformanceFile
+
+    file_class = StreamingPortfolioPerformanceFile if mode == 'stream' else PortfolioPerformanceFile
+    timings = dict()
+    start = time.perf_counter()
+    pp_file = file_class(input_file, 'de')
+    timings['load'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pp_file.append_taxonomy(build_taxonomy(pp_file, pp_file.get_security_candidates()))
+    timings['discover'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pp_file.write_xml(output_file)
+    timings['write'] = time.perf_counter() - start
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'mode': mode, 'seconds': timings, 'peak_rss_mb': round(peak_rss_mb, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the dom and the streaming xml path')
+    parser.add_argument('--size-mb', default=500, type=float, help='size of the synthetic pp file')
+    parser.add_argument('--securities', default=200, type=int, help='securities in the synthetic pp file')
+    parser.add_argument('--zipped', action='store_true', help='also run on the zipped xml file')
+    parser.add_argument('--run-mode', choices=['dom', 'stream'], help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args.run_mode, args.input, args.input + '.' + args.run_mode + '.out')
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_file = os.path.join(tmp, 'synthetic.xml')
+        write_pp_file_of_size(input_file, args.size_mb, args.securities)
+        print(f"synthetic file: {os.path.getsize(input_file) / 1024 / 1024:.0f} MB, {args.securities} securities")
+        input_files = [input_file]
+        if args.zipped:
+            zipped_file = os.path.join(tmp, 'synthetic.portfolio')
+            with zipfile.ZipFile(zipped_file, 'w', zipfile.ZIP_DEFLATED) as archive:
+                archive.write(input_file, ZIP_ENTRY)
+            print(f"zipped file: {os.path.getsize(zipped_file) / 1024 / 1024:.0f} MB")
+            input_files.append(zipped_file)
+        for path in input_files:
+            for mode in ('stream', 'dom'):
+                print(f"{os.path.basename(path)}: ", end='', flush=True)
+                subprocess.run([sys.executable, '-m', 'benchmarks.bench_streaming', '--run-mode', mode,
+                                '--input', path], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""BeautifulSoup x-ray parsing against the single-pass x-ray table parser
+
+python -m benchmarks.bench_xray [--rounds 50] [--page benchmarks/fixtures/xray/xray.html]
+
+Checks that both give the same categories and percentages for every taxonomy. The
+comparison needs beautifulsoup4, which the classifier itself does not use any more.
+"""
+import argparse
+import os
+import time
+
+from src.components.extractors import extractors
+from src.components.xray import parse_xray_tables, extract_xray_table, xray_long_equity, NON_CATEGORIES
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'xray', 'xray.html')
+
+
+def soup_extract(html):
+    """the x-ray parsing as it was done with BeautifulSoup"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    result = dict()
+    for grouping_name, extractor in extractors.items():
+        table = soup.select("table.ms_data")[extractor.xray_table]
+        trs = table.select("tr")[1:]
+        long_equity = None
+        if grouping_name == 'Asset-Type':
+            long_equity = float(trs[0].select("td")[0].text.replace(",", ".")) / 100
+        categories = []
+        percentages = []
+        for tr in trs:
+            if len(tr.select('th')) > 0:
+                header = tr.th
+            else:
+                header = tr.td
+            if tr.text != '' and header.text not in NON_CATEGORIES:
+                categories.append(header.text)
+                if len(tr.select("td")) > extractor.xray_column:
+                    percentages.append(float(
+                        '0' + tr.select("td")[extractor.xray_column].text.replace(",", ".").replace("-", "")))
+                else:
+                    percentages.append(0.0)
+        result[grouping_name] = (*extractor.map_xray(categories, percentages)[:2], long_equity)
+    return result
+
+
+def parser_extract(html):
+    tables = parse_xray_tables(html)
+    result = dict()
+    for grouping_name, extractor in extractors.items():
+        rows = tables[extractor.xray_table]
+        categories, percentages = extract_xray_table(rows, extractor.xray_column)
+        long_equity = xray_long_equity(rows) if grouping_name == 'Asset-Type' else None
+        result[grouping_name] = (*extractor.map_xray(categories, percentages)[:2], long_equity)
+    return result
+
+
+def timed(function, html, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function(html)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the x-ray html fallback parsing')
+    parser.add_argument('--rounds', default=50, type=int, help='times the page is parsed')
+    parser.add_argument('--page', default=FIXTURE, help='saved x-ray page')
+    args = parser.parse_args()
+
+    with open(args.page, encoding='utf-8') as f:
+        html = f.read()
+
+    parser_time = timed(parser_extract, html, args.rounds)
+    print(f"x-ray table parser: {parser_time * 1000:8.2f} ms per page")
+    try:
+        expected = soup_extract(html)
+    except ImportError:
+        print("beautifulsoup4 is not installed, comparison skipped")
+        return
+    assert parser_extract(html) == expected, "x-ray table parser and BeautifulSoup disagree"
+    soup_time = timed(soup_extract, html, args.rounds)
+    print(f"BeautifulSoup:      {soup_time * 1000:8.2f} ms per page")
+    print(f"speedup:            {soup_time / parser_time:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""synthetic portfolio performance files for the benchmarks"""
+import datetime
+import os
+import re
+import time
+import uuid
+
+from src.components.replay import build_response
+
+SECURITY_TPL = """    <security>
+      <uuid>{uuid}</uuid>
+      <name>Synthetic Fund {idx}</name>
+      <currencyCode>EUR</currencyCode>
+      <isin>{isin}</isin>
+      <feed>YAHOO</feed>
+      <prices>
+{prices}
+      </prices>
+      <attributes>
+        <map/>
+      </attributes>
+      <events/>
+      <isRetired>false</isRetired>
+    </security>
+"""
+
+TRANSACTION_TPL = """        <portfolio-transaction>
+          <date>{date}T00:00</date>
+          <currencyCode>EUR</currencyCode>
+          <amount>{amount}</amount>
+          <security reference="../../../../../securities/security[{position}]"/>
+          <shares>{shares}</shares>
+          <type>BUY</type>
+        </portfolio-transaction>
+"""
+
+
+def synthetic_isin(idx):
+    return f"XX{idx:010d}"
+
+
+def price_lines(count, seed):
+    start = datetime.date(2000, 1, 3)
+    return "\n".join(f'        <price t="{start + datetime.timedelta(days=day)}" v="{100000 + (day * 37 + seed) % 5000}"/>'
+                     for day in range(count))
+
+
+def write_pp_file(path, securities=10, prices_per_security=250, transactions_per_security=4):
+    """write a pp xml file with the given number of securities, prices and buy transactions"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<client>\n  <version>47</version>\n  <baseCurrency>EUR</baseCurrency>\n  <securities>\n")
+        for idx in range(securities):
+            f.write(SECURITY_TPL.format(uuid=uuid.UUID(int=idx + 1), idx=idx, isin=synthetic_isin(idx),
+                                        prices=price_lines(prices_per_security, idx)))
+        f.write("  </securities>\n  <watchlists/>\n  <accounts/>\n  <portfolios>\n    <portfolio>\n"
+                "      <uuid>00000000-0000-0000-0000-00000000ffff</uuid>\n      <name>synthetic</name>\n"
+                "      <transactions>\n")
+        for round_ in range(transactions_per_security):
+            for idx in range(securities):
+                f.write(TRANSACTION_TPL.format(date=datetime.date(2010, 1, 1) + datetime.timedelta(days=round_),
+                                               amount=100000 + idx, position=idx + 1,
+                                               shares=1000000 * (round_ + 1)))
+        f.write("      </transactions>\n    </portfolio>\n  </portfolios>\n  <taxonomies/>\n</client>\n")
+
+
+def write_pp_file_of_size(path, size_mb, securities=200):
+    """write a pp xml file of roughly size_mb megabytes, most of it prices like real files"""
+    price_bytes = 45
+    prices = max(1, int(size_mb * 1024 * 1024 / securities / price_bytes))
+    write_pp_file(path, securities=securities, prices_per_security=prices)
+
+
+class SyntheticBackend:
+    """transport backend answering every morningstar request with the benchmark fixtures
+
+    Every SecuritySearch finds an etf, the SAL endpoints answer with the responses of
+    benchmarks/fixtures/sal and the funds whose position is a multiple of xray_every get a
+    401 from SAL, so that they take the x-ray fallback.
+    """
+
+    SAL_FIXTURES = {'/process/asset/': 'asset-type', '/process/weighting/': 'stock-style',
+                    '/portfolio/v2/sector/': 'sector', '/portfolio/holding/v2/': 'holding',
+                    '/portfolio/regionalSector/': 'region', '/portfolio/regionalSectorIncludeCountries/': 'country'}
+
+    def __init__(self, latency=0, xray_every=0):
+        self.latency = latency
+        self.xray_every = xray_every
+        fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+        self.sal = dict()
+        for fragment, name in self.SAL_FIXTURES.items():
+            with open(os.path.join(fixtures, 'sal', name + '.json'), 'rb') as f:
+                self.sal[fragment] = f.read()
+        with open(os.path.join(fixtures, 'xray', 'xray.html'), 'rb') as f:
+            self.xray = f.read()
+
+    def __call__(self, method, url, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if 'SecuritySearch.ashx' in url:
+            isin = kwargs['data']['q']
+            body = f'Synthetic Fund|{{"i":"F{isin[2:]}","n":"Synthetic Fund"}}|ETF|{isin}'.encode()
+            return build_response(method, url, 200, {'Content-Type': 'text/plain'}, body)
+        if 'snapshot.aspx' in url:
+            secid = url.rsplit('=', 1)[1]
+            return build_response(method, url, 200, {}, f"<script>var FC =  '{secid}';</script>".encode())
+        if 'PortfolioSAL.aspx' in url:
+            return build_response(method, url, 200, {}, b'<script>const maasToken = "synthetic-token"</script>')
+        if 'xray' in url:
+            return build_response(method, url, 200, {'Content-Type': 'text/html; charset=utf-8'}, self.xray)
+        for fragment, body in self.sal.items():
+            if fragment in url:
+                secid = re.search(r'/([^/]+)/data$', url).group(1)
+                if self.xray_every and int(secid[1:]) % self.xray_every == 0:
+                    return build_response(method, url, 401, {}, b'')
+                return build_response(method, url, 200, {'Content-Type': 'application/json'}, body)
+        return build_response(method, url, 404, {}, b'')
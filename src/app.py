@@ -1,18 +1,265 @@
 import argparse
+import json
 import logging
+import os
+import sys
 from os import path
 
-import requests_cache
-
-from src.components.classifier import PortfolioPerformanceFile
-from src.components.isin2secid import Isin2secid
-from src.utils.CONSTANTS import DOMAIN_DEFAULT
+# only the argument parsing is imported here: the components (and requests, numpy, the
+# http cache) are imported by the command that needs them, so that --help stays instant
+from src.utils.CONSTANTS import DOMAIN_DEFAULT, WORKERS_DEFAULT, HOST_CONCURRENCY, HOST_RATE_LIMIT, STORE_PATH, \
+    SERVER_HOST, SERVER_PORT, SERVER_CACHE_SIZE, HTTP_TIMEOUT, HTTP_RETRIES, STORE_RETENTION, \
+    LOOKTHROUGH_DEPTH
+from src.utils.run_report import RunReport
 from src.utils.taxonomies import taxonomies
 
-requests_cache.install_cache(expire_after=60 * 60 * 24)  # cache downloaded files for a day
-requests_cache.remove_expired_responses()
 
-if __name__ == '__main__':
+def open_stores(args, cache_size=0):
+    from src.components.classification_store import ClassificationStore
+    from src.components.isin2secid import Isin2secid
+    from src.components.secid2fc import Secid2fc
+    Isin2secid.load_cache()
+    Secid2fc.load_cache()
+    ClassificationStore.open(STORE_PATH, get_max_age(args), getattr(args, 'refresh', False), cache_size)
+
+
+def get_max_age(args):
+    return None if args.max_age is None else args.max_age * 60 * 60 * 24
+
+
+def close_stores():
+    from src.components.classification_store import ClassificationStore
+    from src.components.holdings import Revalidation
+    from src.components.isin2secid import Isin2secid
+    from src.components.secid2fc import Secid2fc
+    # the stale classifications used by the run are stored for the next ones
+    Revalidation.wait()
+    Isin2secid.save_cache()
+    Secid2fc.save_cache()
+    ClassificationStore.close()
+
+
+def classify(args):
+    from src.components.classifier import PortfolioPerformanceFile
+    from src.components.file_format import OUTPUT_FILES
+    from src.components.replay import RecordingBackend, ReplayBackend
+    from src.components.streaming import StreamingPortfolioPerformanceFile
+
+    domain = args.domain
+    backend = None
+    if args.replay:
+        backend = ReplayBackend(args.replay)
+    elif args.record:
+        backend = RecordingBackend(args.record)
+    configure_transport(args, backend)
+    open_stores(args)
+    with RunReport.phase('load'):
+        if args.stream:
+            pp_file = StreamingPortfolioPerformanceFile(args.input_file, domain, args.workers, args.taxonomies,
+                                                        args.look_through)
+        else:
+            pp_file = PortfolioPerformanceFile(args.input_file, domain, args.workers, args.taxonomies,
+                                               args.look_through)
+    with RunReport.phase('fetch'):
+        pp_file.get_securities()
+    for taxonomy in args.taxonomies:
+        pp_file.add_taxonomy(taxonomy)
+    if args.exposure:
+        with RunReport.phase('exposure'):
+            write_exposure(pp_file, args.exposure, args.taxonomies)
+    # Write the enhanced portfolio, in the format of the input file
+    output_path = args.output_file or OUTPUT_FILES[pp_file.file_format]
+    with RunReport.phase('write'):
+        pp_file.write_xml(output_path)
+    # after the output is written: the stale classifications may still be revalidated
+    close_stores()
+
+
+def write_exposure(pp_file, exposure_path, kinds):
+    """write the look-through exposure of the portfolio to each category as json, largest first"""
+    exposure = pp_file.get_exposure(kinds)
+    with open(exposure_path, 'w') as f:
+        json.dump({kind: {category: round(weight, 2) for category, weight in
+                          sorted(weights.items(), key=lambda item: item[1], reverse=True)}
+                   for kind, weights in exposure.items()}, f, indent=1)
+
+
+def taxonomies_argument(value):
+    from src.components.extractors import select_taxonomies
+    try:
+        return select_taxonomies(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def add_fetch_arguments(parser):
+    parser.add_argument('-w', default=WORKERS_DEFAULT, dest='workers', type=int,
+                        help=f'number of securities fetched in parallel (default: {WORKERS_DEFAULT})')
+
+    parser.add_argument('--host-concurrency', default=HOST_CONCURRENCY, dest='host_concurrency', type=int,
+                        help=f'maximum simultaneous requests per host (default: {HOST_CONCURRENCY})')
+
+    parser.add_argument('--rate-limit', default=HOST_RATE_LIMIT, dest='rate_limit', type=float,
+                        help=f'maximum requests per second per host, 0 for no limit (default: {HOST_RATE_LIMIT})')
+
+    parser.add_argument('--timeout', default=HTTP_TIMEOUT[1], type=float,
+                        help=f'seconds to wait for a response before retrying (default: {HTTP_TIMEOUT[1]})')
+
+    parser.add_argument('--retries', default=HTTP_RETRIES, type=int,
+                        help=f'retries of a failed or throttled request (default: {HTTP_RETRIES})')
+
+    parser.add_argument('--look-through', nargs='?', default=0, const=LOOKTHROUGH_DEPTH, dest='look_through',
+                        type=int, metavar='DEPTH',
+                        help='expand the funds held by the funds with their own classification, down to DEPTH '
+                             f'levels (default without DEPTH: {LOOKTHROUGH_DEPTH})')
+
+    parser.add_argument('--max-age', dest='max_age', type=float, metavar='DAYS',
+                        help='days a stored classification is used before it is fetched again (default: until a '
+                             'newer Morningstar portfolio is likely to be published)')
+
+
+def configure_transport(args, backend=None):
+    from src.components.transport import Transport, install_http_cache
+    install_http_cache()
+    Transport.configure(concurrency=args.host_concurrency, rate_limit=args.rate_limit, backend=backend,
+                        timeout=(HTTP_TIMEOUT[0], args.timeout), retries=args.retries)
+
+
+def add_taxonomies_argument(parser):
+    parser.add_argument('--taxonomies', default=list(taxonomies), dest='taxonomies', type=taxonomies_argument,
+                        metavar='NAMES', help=f"comma separated taxonomies to add (default: {','.join(taxonomies)})")
+
+
+def serve_main(argv):
+    """app.py serve: classify the files posted to a local api, keeping the caches warm between them"""
+    parser = argparse.ArgumentParser(prog='app.py serve', description='\r\n'.join(
+        ["runs the classifier as a server: POST a portfolio performance xml file to /classify",
+         "and get back the classified file (or only its taxonomies with ?output=taxonomies)"]))
+
+    add_fetch_arguments(parser)
+
+    parser.add_argument('--host', default=SERVER_HOST, dest='host', type=str,
+                        help=f'address to listen on (default: {SERVER_HOST})')
+
+    parser.add_argument('--port', default=SERVER_PORT, dest='port', type=int,
+                        help=f'port to listen on (default: {SERVER_PORT})')
+
+    parser.add_argument('--socket', dest='socket', type=str, metavar='PATH',
+                        help='listen on a unix socket instead of a port')
+
+    parser.add_argument('--cache-size', default=SERVER_CACHE_SIZE, dest='cache_size', type=int,
+                        help=f'entries kept in memory by each cache (default: {SERVER_CACHE_SIZE})')
+
+    parser.add_argument('--replay', dest='replay', type=str, metavar='DIR',
+                        help='answer the morningstar requests with the responses saved in DIR, without network access')
+
+    args = parser.parse_args(argv)
+
+    from src.components.isin2secid import Isin2secid
+    from src.components.replay import ReplayBackend
+    from src.components.secid2fc import Secid2fc
+    from src.components.server import ClassifierService, serve
+
+    backend = ReplayBackend(args.replay) if args.replay else None
+    configure_transport(args, backend)
+    Isin2secid.cache_size = args.cache_size
+    Secid2fc.cache_size = args.cache_size
+    open_stores(args, args.cache_size)
+    try:
+        serve(ClassifierService(args.workers, args.look_through), args.host, args.port, args.socket)
+    finally:
+        close_stores()
+
+
+def batch_main(argv):
+    """app.py batch: classify all the files of a directory or manifest, fetching each security once"""
+    parser = argparse.ArgumentParser(prog='app.py batch', description='\r\n'.join(
+        ["classifies many portfolio performance xml files in one run: the securities held in any",
+         "of them are fetched once, then the files are classified in parallel processes"]))
+
+    parser.add_argument('source', metavar='source', type=str,
+                        help='directory of unencrypted pp.xml (or zipped .portfolio) files, or a manifest listing one file per line')
+
+    parser.add_argument('-o', default='classified', dest='output_dir', type=str,
+                        help='directory of the auto-classified output files (default: classified)')
+
+    parser.add_argument('-j', default=os.cpu_count(), dest='processes', type=int,
+                        help='number of files classified in parallel (default: number of cpus)')
+
+    add_taxonomies_argument(parser)
+
+    parser.add_argument('-d', default=DOMAIN_DEFAULT, dest='domain', type=str,
+                        help=f'Morningstar domain from which to retrieve the secid (default: {DOMAIN_DEFAULT})')
+
+    add_fetch_arguments(parser)
+
+    parser.add_argument('--refresh', action='store_true', dest='refresh',
+                        help='ignore the stored classifications and fetch every security again')
+
+    parser.add_argument('--stream', action='store_true', dest='stream',
+                        help='read and write the files without loading them completely in memory')
+
+    parser.add_argument('--replay', dest='replay', type=str, metavar='DIR',
+                        help='answer the morningstar requests with the responses saved in DIR, without network access')
+
+    parser.add_argument('--report', dest='report', type=str, metavar='FILE',
+                        help='write the timings, requests and cache statistics of the run as json to FILE')
+
+    args = parser.parse_args(argv)
+
+    from src.components.batch import classify_batch, list_portfolio_files
+    from src.components.replay import ReplayBackend
+
+    if args.report:
+        RunReport.start()
+    backend = ReplayBackend(args.replay) if args.replay else None
+    configure_transport(args, backend)
+    open_stores(args)
+    try:
+        failed = classify_batch(list_portfolio_files(args.source), args.output_dir, args.domain, args.taxonomies,
+                                args.workers, args.processes, args.stream, args.replay, args.host_concurrency,
+                                args.rate_limit, (HTTP_TIMEOUT[0], args.timeout), args.retries,
+                                args.look_through, get_max_age(args))
+    finally:
+        close_stores()
+    if args.report:
+        RunReport.write(args.report)
+    if failed:
+        sys.exit(1)
+
+
+def maintenance_main(argv):
+    """app.py maintenance: remove the expired entries of the caches and compact them"""
+    parser = argparse.ArgumentParser(prog='app.py maintenance', description='\r\n'.join(
+        ["removes the expired downloads, secid misses and classifications from the caches;",
+         "meant to be scheduled (e.g. daily) instead of being done on every run"]))
+
+    parser.add_argument('--keep-days', default=STORE_RETENTION / (60 * 60 * 24), dest='keep_days', type=float,
+                        help='days an expired classification is kept before being removed '
+                             f'(default: {STORE_RETENTION // (60 * 60 * 24)})')
+
+    args = parser.parse_args(argv)
+
+    from src.components.classification_store import ClassificationStore
+    from src.components.isin2secid import Isin2secid
+    from src.components.transport import prune_http_cache
+
+    print(f"http cache: {prune_http_cache()} responses left")
+    Isin2secid.load_cache()
+    print(f"secids: {Isin2secid.prune()} expired misses removed")
+    Isin2secid.save_cache()
+    ClassificationStore.open(STORE_PATH)
+    print(f"classifications: {ClassificationStore.prune(args.keep_days * 60 * 60 * 24)} rows removed")
+    ClassificationStore.close()
+
+
+if __name__ == '__main__' and sys.argv[1:2] == ['serve']:
+    serve_main(sys.argv[2:])
+elif __name__ == '__main__' and sys.argv[1:2] == ['batch']:
+    batch_main(sys.argv[2:])
+elif __name__ == '__main__' and sys.argv[1:2] == ['maintenance']:
+    maintenance_main(sys.argv[2:])
+elif __name__ == '__main__':
     logging.basicConfig(filename=path.join('_tmp', 'app.log'), filemode='a+',
                         format='%(asctime)s-%(levelname)s-%(message)s', level=logging.INFO)
     logging.info('Starting the app')
@@ -28,22 +275,56 @@ if __name__ == '__main__':
     parser.add_argument('-d', default=DOMAIN_DEFAULT, dest='domain', type=str,
                         help='Morningstar domain from which to retrieve the secid (default: es)')
 
-    parser.add_argument('input_file', metavar='input_file', type=str, help='path to unencrypted pp.xml file')
+    add_fetch_arguments(parser)
+
+    add_taxonomies_argument(parser)
+
+    parser.add_argument('--refresh', action='store_true', dest='refresh',
+                        help='ignore the stored classifications and fetch every security again')
+
+    parser.add_argument('--record', dest='record', type=str, metavar='DIR',
+                        help='save every morningstar response in DIR, to be replayed later with --replay')
+
+    parser.add_argument('--replay', dest='replay', type=str, metavar='DIR',
+                        help='answer the morningstar requests with the responses saved in DIR, without network access')
+
+    parser.add_argument('--report', dest='report', type=str, metavar='FILE',
+                        help='write the timings, requests and cache statistics of the run as json to FILE')
+
+    parser.add_argument('--profile', dest='profile', type=str, metavar='FILE',
+                        help='profile the run with cProfile and dump the statistics to FILE')
+
+    parser.add_argument('--exposure', dest='exposure', type=str, metavar='FILE',
+                        help='write the look-through exposure of the whole portfolio to each category as json to FILE')
+
+    parser.add_argument('--stream', action='store_true', dest='stream',
+                        help='read and write the file without loading it completely in memory (for very large files)')
+
+    parser.add_argument('input_file', metavar='input_file', type=str,
+                        help='path to unencrypted pp.xml file, or zipped xml .portfolio file')
 
     parser.add_argument('output_file', metavar='output_file', type=str, nargs='?',
-                        help='path to auto-classified output file', default='pp_classified.xml')
+                        help='path to auto-classified output file, written in the format of the input file '
+                             '(default: pp_classified.xml, pp_classified.portfolio for a zipped file)')
 
     args = parser.parse_args()
 
     if "input_file" not in args:
         parser.print_help()
     else:
-        domain = args.domain
-        Isin2secid.load_cache()
-        pp_file = PortfolioPerformanceFile(args.input_file, domain)
-        for taxonomy in taxonomies:
-            pp_file.add_taxonomy(taxonomy)
-        Isin2secid.save_cache()
-        # Write the enhanced portfolio
-        output_path = args.output_file
-        pp_file.write_xml(output_path)
+        from src.components.file_format import detect_format, UnsupportedFormatError
+        try:
+            detect_format(args.input_file)
+        except UnsupportedFormatError as e:
+            parser.error(f"{args.input_file}: {e}")
+        if args.report:
+            RunReport.start()
+        if args.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.runcall(classify, args)
+            profiler.dump_stats(args.profile)
+        else:
+            classify(args)
+        if args.report:
+            RunReport.write(args.report)
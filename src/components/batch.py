@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.components.classification_store import ClassificationStore
+from src.components.classifier import PortfolioPerformanceFile
+from src.components.fetcher import fetch_holdings
+from src.components.file_format import EXTENSIONS
+from src.components.holdings import Security, Revalidation
+from src.components.isin2secid import Isin2secid
+from src.components.replay import ReplayBackend
+from src.components.secid2fc import Secid2fc
+from src.components.streaming import StreamingPortfolioPerformanceFile
+from src.components.transport import Transport, install_http_cache
+from src.utils.CONSTANTS import WORKERS_DEFAULT, HOST_CONCURRENCY, HOST_RATE_LIMIT, HTTP_TIMEOUT, HTTP_RETRIES, STORE_PATH
+from src.utils.run_report import RunReport
+from src.utils.taxonomies import taxonomies
+
+
+def list_portfolio_files(source):
+    """the xml and .portfolio files of a directory, or the files listed in a manifest (one per line, relative to it)"""
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith(EXTENSIONS))
+    base = os.path.dirname(source)
+    with open(source) as f:
+        return [os.path.join(base, line.strip()) for line in f if line.strip() and not line.startswith('#')]
+
+
+def get_output_paths(files, output_dir):
+    """output file of each input file, named like it; files with the same name are numbered"""
+    outputs = []
+    used = set()
+    for path in files:
+        name = os.path.basename(path)
+        stem, extension = os.path.splitext(name)
+        number = 1
+        while name in used:
+            number += 1
+            name = f"{stem}-{number}{extension}"
+        used.add(name)
+        outputs.append(os.path.join(output_dir, name))
+    return outputs
+
+
+def open_portfolio(path, domain, workers, stream, kinds=None, look_through=0):
+    if stream:
+        return StreamingPortfolioPerformanceFile(path, domain, workers, kinds, look_through)
+    return PortfolioPerformanceFile(path, domain, workers, kinds, look_through)
+
+
+def init_worker(replay, host_concurrency, rate_limit, timeout, retries, max_age):
+    """open the shared stores in a worker process; the holdings are read from the classification store
+
+    The stale classifications are revalidated by the main process, not by the workers.
+    """
+    backend = ReplayBackend(replay) if replay else None
+    install_http_cache()
+    Transport.configure(concurrency=host_concurrency, rate_limit=rate_limit, backend=backend, timeout=timeout,
+                        retries=retries)
+    Isin2secid.load_cache()
+    Secid2fc.load_cache()
+    ClassificationStore.open(STORE_PATH, max_age)
+    Revalidation.enabled = False
+
+
+def scan_portfolio(path, domain, stream):
+    """isin, secid and name of the securities of a file that are to be classified"""
+    pp_file = open_portfolio(path, domain, 1, stream)
+    return [(security.ISIN, security.secid, security.name) for security in pp_file.get_security_candidates()]
+
+
+def classify_portfolio(path, output_path, domain, kinds, workers, stream, look_through=0):
+    pp_file = open_portfolio(path, domain, workers, stream, kinds, look_through)
+    securities = pp_file.get_securities()
+    for kind in kinds:
+        pp_file.add_taxonomy(kind)
+    pp_file.write_xml(output_path)
+    return len(securities)
+
+
+def classify_batch(files, output_dir, domain, kinds=tuple(taxonomies), workers=WORKERS_DEFAULT, processes=None,
+                   stream=False, replay=None, host_concurrency=HOST_CONCURRENCY, rate_limit=HOST_RATE_LIMIT,
+                   timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, look_through=0, max_age=None):
+    """classify many files, fetching every security held in any of them once
+
+    The files are scanned in worker processes for the union of their securities, whose
+    holdings are then fetched by this process into the classification store; the worker
+    processes finally classify and write each file from the store, the held funds of the
+    look-through included. The caller opens the
+    stores of this process, as for a single file.
+    """
+    outputs = get_output_paths(files, output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    # spawned workers do not inherit the sqlite connections of this process
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=init_worker,
+                             initargs=(replay, host_concurrency, rate_limit, timeout, retries, max_age)) as executor:
+        failed = []
+        scanned = []
+        securities = dict()
+        with RunReport.phase('scan'):
+            futures = [executor.submit(scan_portfolio, path, domain, stream) for path in files]
+            for path, output_path, future in zip(files, outputs, futures):
+                try:
+                    candidates = future.result()
+                except Exception as e:
+                    print(f"{path}: cannot be read: {e!r}")
+                    failed.append(path)
+                    continue
+                scanned.append((path, output_path))
+                for isin, secid, name in candidates:
+                    securities.setdefault(isin, Security(name=name, ISIN=isin, secid=secid, UUID=None))
+        print(f"{len(securities)} distinct securities in {len(scanned)} files")
+
+        with RunReport.phase('fetch'):
+            Isin2secid.get_secids(list(securities), domain, workers)
+            fetch_holdings(list(securities.values()), domain, workers, kinds, look_through)
+
+        with RunReport.phase('classify'):
+            futures = {executor.submit(classify_portfolio, path, output_path, domain, kinds, workers, stream,
+                                       look_through): path
+                       for path, output_path in scanned}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    print(f"{path}: {future.result()} securities classified")
+                except Exception as e:
+                    print(f"{path}: classification failed: {e!r}")
+                    failed.append(path)
+    return failed
@@ -0,0 +1,78 @@
+import base64
+import json
+import re
+import threading
+import time
+
+import requests
+
+from src.components.secid2fc import USER_AGENT
+from src.components.transport import Transport
+from src.utils.CONSTANTS import TOKEN_TTL, TOKEN_EXPIRY_MARGIN, TOKEN_MIN_AGE
+
+
+class TokenNotFoundError(requests.RequestException):
+    pass
+
+
+class BearerToken:
+    """maasToken shared by all securities of a morningstar domain
+
+    The token is scraped once per domain and renewed when it expires or when the
+    api rejects it with a 401.
+    """
+    tokens = dict()
+    lock = threading.Lock()
+    domain_locks = dict()
+
+    @staticmethod
+    def get_domain_lock(domain):
+        with BearerToken.lock:
+            return BearerToken.domain_locks.setdefault(domain, threading.Lock())
+
+    @staticmethod
+    def get(domain, secid):
+        with BearerToken.get_domain_lock(domain):
+            token = BearerToken.tokens.get(domain)
+            if token is None or token['expires'] <= time.time():
+                token = BearerToken.fetch(domain, secid)
+            return token['value']
+
+    @staticmethod
+    def refresh(domain, rejected_token, secid):
+        """renew the token of the domain after it was rejected, returns the token to retry with"""
+        with BearerToken.get_domain_lock(domain):
+            token = BearerToken.tokens.get(domain)
+            if token is not None and (token['value'] != rejected_token or time.time() - token['fetched'] < TOKEN_MIN_AGE):
+                # already renewed by another security or too recent to be the cause of the 401
+                return token['value']
+            return BearerToken.fetch(domain, secid)['value']
+
+    @staticmethod
+    def fetch(domain, secid):
+        headers = {'user-agent': USER_AGENT}
+        url = f'https://www.morningstar.{domain}/Common/funds/snapshot/PortfolioSAL.aspx'
+        payload = {'FC': secid}
+        response = Transport.get(url, headers=headers, params=payload)
+        # the last answer of the retries is an error
+        response.raise_for_status()
+        token_regex = r"const maasToken \=\s\"(.+)\""
+        values = re.findall(token_regex, response.text)
+        if not values:
+            raise TokenNotFoundError(f"no maasToken in the page of {secid} for domain '{domain}'", response=response)
+        value = values[0]
+        now = time.time()
+        token = {'value': value, 'fetched': now,
+                 'expires': BearerToken.get_expiry(value, now + TOKEN_TTL) - TOKEN_EXPIRY_MARGIN}
+        BearerToken.tokens[domain] = token
+        return token
+
+    @staticmethod
+    def get_expiry(value, default):
+        """read the exp claim of a jwt token"""
+        try:
+            payload = value.split('.')[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+            return float(claims['exp'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return default
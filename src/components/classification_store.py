@@ -0,0 +1,171 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+from src.components.extractors import FundHolding
+from src.components.grouping import freeze_groupings, thaw_groupings
+from src.utils.CONSTANTS import STORE_PATH, STORE_MAX_AGE, STORE_STALE_WINDOW, PORTFOLIO_INTERVAL, PORTFOLIO_LAG, \
+    PORTFOLIO_RECHECK
+from src.utils.lru import LRUCache
+
+# version 2: groupings with unescaped category names, not scaled by the long equity share
+# version 3: funds held by each fund, for the look-through
+SCHEMA_VERSION = 3
+
+
+class StoredClassification(NamedTuple):
+    grouping: dict
+    long_equity: float
+    funds: list
+    portfolio_date: str
+    fetched_at: float
+    # past its expiry: to be used while it is fetched again
+    stale: bool
+
+
+class ClassificationStore:
+    """groupings of each secid kept between runs, so that unchanged securities are not fetched again
+
+    Every row is keyed by secid and Morningstar portfolioDate and carries the freshness
+    policy it was stored with: it expires when a newer portfolio is likely to be published
+    (see get_expiry), or max_age seconds after it was fetched when a max_age is given. A row
+    is still returned, marked stale, during STORE_STALE_WINDOW seconds after its expiry; an
+    older one is ignored and fetched again.
+    The most recently used groupings can also be kept in memory, for a long-running server.
+    """
+    connection = None
+    memory = LRUCache(0)
+    max_age = None
+    refresh = False
+    lock = threading.Lock()
+
+    @staticmethod
+    def open(path=STORE_PATH, max_age=None, refresh=False, cache_size=0):
+        """open the store; with refresh the stored groupings are not used but still updated
+
+        max_age (seconds) overrides the expiry of the rows, the older ones are not used at all. cache_size groupings are kept in
+        memory in front of the database.
+        """
+        with ClassificationStore.lock:
+            if ClassificationStore.connection is not None:
+                ClassificationStore.connection.close()
+            connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            if connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                # groupings stored by previous versions are fetched again
+                connection.execute("DROP TABLE IF EXISTS groupings")
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.execute("""CREATE TABLE IF NOT EXISTS groupings (
+                                      secid TEXT NOT NULL,
+                                      portfolio_date TEXT NOT NULL,
+                                      fetched_at REAL NOT NULL,
+                                      expires_at REAL NOT NULL,
+                                      policy TEXT NOT NULL,
+                                      grouping TEXT NOT NULL,
+                                      long_equity REAL,
+                                      funds TEXT,
+                                      PRIMARY KEY (secid, portfolio_date))""")
+            connection.commit()
+            ClassificationStore.connection = connection
+            ClassificationStore.memory = LRUCache(cache_size)
+            ClassificationStore.max_age = max_age
+            ClassificationStore.refresh = refresh
+
+    @staticmethod
+    def close():
+        with ClassificationStore.lock:
+            if ClassificationStore.connection is not None:
+                ClassificationStore.connection.close()
+                ClassificationStore.connection = None
+
+    @staticmethod
+    def prune(retention):
+        """remove the rows superseded by a newer fetch of their secid and the rows expired for more
+        than retention seconds, return how many were removed"""
+        with ClassificationStore.lock:
+            if ClassificationStore.connection is None:
+                return 0
+            connection = ClassificationStore.connection
+            removed = connection.execute(
+                """DELETE FROM groupings WHERE expires_at <= ? OR fetched_at <
+                       (SELECT MAX(fetched_at) FROM groupings AS newer WHERE newer.secid = groupings.secid)""",
+                (time.time() - retention,)).rowcount
+            connection.commit()
+            connection.execute("VACUUM")
+        return removed
+
+    @staticmethod
+    def get(secid):
+        """return the StoredClassification of the secid, None if there is none or it is too old to be used"""
+        with ClassificationStore.lock:
+            if ClassificationStore.connection is None or ClassificationStore.refresh:
+                return None
+            cached = ClassificationStore.memory.get(secid)
+            if cached is None:
+                row = ClassificationStore.connection.execute(
+                    """SELECT grouping, long_equity, funds, portfolio_date, fetched_at, expires_at FROM groupings
+                       WHERE secid = ? ORDER BY fetched_at DESC LIMIT 1""",
+                    (secid,)).fetchone()
+                if row is None:
+                    return None
+                funds = None if row[2] is None else [FundHolding(*fund) for fund in json.loads(row[2])]
+                cached = (freeze_groupings(json.loads(row[0])), row[1], funds, row[3] or None, row[4], row[5])
+                ClassificationStore.memory[secid] = cached
+        grouping, long_equity, funds, portfolio_date, fetched_at, expires_at = cached
+        now = time.time()
+        if ClassificationStore.max_age is not None:
+            # an explicit age limit replaces the expiry and is a hard one: nothing older is served stale
+            expires_at = fetched_at + ClassificationStore.max_age
+            if expires_at <= now:
+                return None
+        elif now - expires_at >= STORE_STALE_WINDOW:
+            return None
+        return StoredClassification(grouping, long_equity, funds, portfolio_date, fetched_at, expires_at <= now)
+
+    @staticmethod
+    def put(secid, portfolio_date, grouping, long_equity, funds=None, fetched_at=None):
+        """store the groupings of the secid
+
+        fetched_at is given when kinds were added to a stored row: the row keeps its age, and
+        its expiry, instead of being made fresh by the kinds fetched now. Returns the fetch time
+        of the row.
+        """
+        if fetched_at is None:
+            fetched_at = time.time()
+        expires_at, policy = get_expiry(portfolio_date, fetched_at)
+        with ClassificationStore.lock:
+            if ClassificationStore.connection is None:
+                return fetched_at
+            ClassificationStore.memory[secid] = (freeze_groupings(grouping), long_equity, funds, portfolio_date, fetched_at,
+                                                 expires_at)
+            # the row extended is replaced, even if the kinds added brought an older portfolio date
+            ClassificationStore.connection.execute("DELETE FROM groupings WHERE secid = ? AND fetched_at = ?",
+                                                   (secid, fetched_at))
+            ClassificationStore.connection.execute(
+                "INSERT OR REPLACE INTO groupings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (secid, portfolio_date or '', fetched_at, expires_at, policy, json.dumps(thaw_groupings(grouping)),
+                 long_equity, None if funds is None else json.dumps(funds)))
+            ClassificationStore.connection.commit()
+        return fetched_at
+
+
+def get_expiry(portfolio_date, now):
+    """time until which a classification fetched now is fresh, and the policy it follows
+
+    Morningstar publishes the portfolio of most funds monthly, some time after its date, so
+    a classification is fresh until the next portfolio is likely out. A fund whose next
+    portfolio is overdue is checked again after a tenth of the age of its portfolio, between
+    STORE_MAX_AGE and PORTFOLIO_RECHECK; without a portfolio date after STORE_MAX_AGE.
+    """
+    try:
+        date = datetime.datetime.fromisoformat(portfolio_date[:10]).replace(tzinfo=datetime.timezone.utc)
+    except (TypeError, ValueError):
+        return now + STORE_MAX_AGE, f"max-age={STORE_MAX_AGE}"
+    published = date.timestamp()
+    next_portfolio = published + PORTFOLIO_INTERVAL + PORTFOLIO_LAG
+    if next_portfolio > now + STORE_MAX_AGE:
+        return next_portfolio, f"portfolio-date={portfolio_date[:10]}"
+    recheck = min(PORTFOLIO_RECHECK, max(STORE_MAX_AGE, (now - published) / 10))
+    return now + recheck, f"portfolio-date={portfolio_date[:10]}; overdue"
@@ -1,13 +1,36 @@
+import re
 import uuid
 from collections import defaultdict
 from itertools import cycle
 from typing import NamedTuple
 from xml.etree import ElementTree as ET
 
-from jinja2 import Environment, BaseLoader
+import numpy as np
 
+from src.components.discovery import find_security_references
+from src.components.fetcher import fetch_holdings
+from src.components.file_format import detect_format, open_portfolio_file, create_portfolio_file, \
+    get_content_size
 from src.components.holdings import Security
-from src.utils.CONSTANTS import COLORS
+from src.components.isin2secid import Isin2secid
+from src.components.weights import WeightMatrix
+from src.utils.CONSTANTS import COLORS, WORKERS_DEFAULT
+from src.utils.run_report import RunReport
+
+
+SECURITY_XPATH_REGEX = re.compile(r"(?:^|/)security(?:\[(\d+)\])?$")
+# the root classification of the taxonomies created by the classifier has a fixed id per kind, by which
+# they are told apart from the taxonomies of the user that have the same name
+TAXONOMY_ROOT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/aklexus/pp-portfolio-classifier')
+
+
+def get_taxonomy_root_id(kind):
+    return str(uuid.uuid5(TAXONOMY_ROOT_NAMESPACE, kind))
+
+
+def get_security_xpath(position):
+    if position is not None:
+        return f"../../../../../../../../securities/security[{position + 1}]"
 
 
 class PortfolioPerformanceCategory(NamedTuple):
@@ -17,131 +40,315 @@ class PortfolioPerformanceCategory(NamedTuple):
 
 
 class PortfolioPerformanceFile:
+    """portfolio performance file in plain or zipped xml, written back in the same format"""
 
-    def __init__(self, filepath, domain):
+    def __init__(self, filepath, domain, workers=WORKERS_DEFAULT, kinds=None, look_through=0):
         self.filepath = filepath
-        self.pp_tree = ET.parse(filepath)
+        self.file_format = detect_format(filepath)
+        with open_portfolio_file(filepath, self.file_format) as f:
+            self.pp_tree = ET.parse(f)
         self.pp = self.pp_tree.getroot()
         self.securities = None
+        self.references = None
+        self.weight_matrices = dict()
         self.domain = domain
+        self.workers = workers
+        # taxonomies fetched with the securities, the others are fetched when they are added
+        self.kinds = kinds
+        # levels of funds held by the funds that are expanded
+        self.look_through = look_through
+        # bumped by the code that changes the securities, see securities_changed
+        self.securities_version = 0
+        self.build_security_index()
 
-    def get_security(self, security_xpath):
-        """return a security object """
-        security = self.pp.findall(security_xpath)[0]
-        if security is not None:
+    def build_security_index(self):
+        """index the securities list once: position by uuid and element by isin"""
+        self.index_securities(self.pp.findall("securities/security"))
+        self.index_state = self.get_index_state()
+
+    def get_index_state(self):
+        """what the index is checked against: the version, the <securities> element and its length"""
+        securities = self.pp.find('securities')
+        return self.securities_version, securities, 0 if securities is None else len(securities)
+
+    def securities_changed(self):
+        """to be called after replacing, moving or editing a security, the index is rebuilt on next use"""
+        self.securities_version += 1
+
+    def index_securities(self, security_elements):
+        self.security_elements = security_elements
+        self.security_positions = dict()
+        self.security_by_isin = dict()
+        for idx, security in enumerate(security_elements):
+            sec_uuid = security.find('uuid')
+            if sec_uuid is not None:
+                self.security_positions[sec_uuid.text] = idx
             isin = security.find('isin')
             if isin is not None:
-                isin = isin.text
-                secid = security.find('secid')
-                if secid is not None:
-                    secid = secid.text
-                return Security(name=security.find('name').text, ISIN=isin, secid=secid,
-                                UUID=security.find('uuid').text, )
-            else:
-                name = security.find('name').text
-                print(f"security '{name}' does not have isin, skipping it...")
+                self.security_by_isin[isin.text] = security
+
+    def check_security_index(self):
+        """rebuild the index if the securities changed since it was built
+
+        Securities added or removed change the length of <securities>, the other changes are
+        told by securities_changed. The check does not walk the securities, it runs on every
+        lookup.
+        """
+        if self.get_index_state() != self.index_state:
+            self.build_security_index()
+            # the references found are positions in the securities list
+            self.references = None
+
+    def get_security_by_isin(self, isin):
+        self.check_security_index()
+        return self.security_by_isin.get(isin)
+
+    def get_security(self, security, **kwargs):
+        """return a security object for a <security> element, None if it has no isin"""
+        isin = security.find('isin')
+        if isin is not None:
+            isin = isin.text
+            secid = security.find('secid')
+            if secid is not None:
+                secid = secid.text
+            return Security(name=security.find('name').text, ISIN=isin, secid=secid,
+                            UUID=security.find('uuid').text, **kwargs)
+        name = security.find('name').text
+        print(f"security '{name}' does not have isin, skipping it...")
         return None
 
     def get_security_xpath_by_uuid(self, uuid):
-        for idx, security in enumerate(self.pp.findall(".//securities/security")):
-            sec_uuid = security.find('uuid').text
-            if sec_uuid == uuid:
-                return f"../../../../../../../../securities/security[{idx + 1}]"
+        self.check_security_index()
+        return get_security_xpath(self.security_positions.get(uuid))
 
     def add_taxonomy(self, kind):
+        """add the taxonomy, or bring the one added by a previous run up to date, and return it"""
+        taxonomy = self.build_taxonomy(kind)
+        existing = self.find_taxonomy(kind)
+        if existing is None:
+            self.append_taxonomy(taxonomy)
+            return taxonomy
+        if self.update_taxonomy(existing, taxonomy):
+            self.replace_taxonomy(existing)
+        return existing
+
+    def append_taxonomy(self, taxonomy):
+        self.pp.find('.//taxonomies').append(taxonomy)
+
+    def replace_taxonomy(self, taxonomy):
+        # the taxonomy was updated in place in the tree
+        pass
+
+    def get_taxonomies(self):
+        taxonomies = self.pp.find('.//taxonomies')
+        return [] if taxonomies is None else taxonomies
+
+    def find_taxonomy(self, kind):
+        """the taxonomy created for this kind by a previous run, if any
+
+        It is recognized by the id of its root classification: a taxonomy of the user with
+        the same name is left alone and the classifier adds its own next to it.
+        """
+        root_id = get_taxonomy_root_id(kind)
+        for taxonomy in self.get_taxonomies():
+            if taxonomy.tag == 'taxonomy' and taxonomy.findtext('root/id') == root_id:
+                return taxonomy
+        return None
+
+    def get_assignment_security(self, assignment):
+        """uuid of the security an assignment refers to (the reference itself if it cannot be resolved)
+
+        The caller checks the security index beforehand.
+        """
+        vehicle = assignment.find('investmentVehicle')
+        reference = vehicle.get('reference', '') if vehicle is not None else ''
+        match = SECURITY_XPATH_REGEX.search(reference)
+        if match is not None:
+            idx = int(match.group(1) or 1) - 1
+            if idx < len(self.security_elements):
+                return self.security_elements[idx].findtext('uuid')
+        return reference
+
+    def get_taxonomy_weights(self, children):
+        """{security: {category: weight}} of the classifications of a flat taxonomy"""
+        weights = defaultdict(dict)
+        for classification in children.findall('classification'):
+            category = classification.findtext('name')
+            for assignment in classification.find('assignments'):
+                weights[self.get_assignment_security(assignment)][category] = assignment.findtext('weight')
+        return weights
+
+    def update_taxonomy(self, taxonomy, built):
+        """update a taxonomy of a previous run with a newly built one
+
+        The ids, colors and ranks of the existing categories are kept and only the
+        assignments of the securities whose weights changed are replaced. Returns False,
+        leaving the taxonomy untouched, if no weight changed.
+        """
+        self.check_security_index()
+        children = taxonomy.find('root/children')
+        built_children = built.find('root/children')
+        old_weights = self.get_taxonomy_weights(children)
+        new_weights = self.get_taxonomy_weights(built_children)
+        changed = {security for security in old_weights.keys() | new_weights.keys()
+                   if old_weights.get(security) != new_weights.get(security)}
+        if not changed:
+            return False
+
+        classifications = {classification.findtext('name'): classification
+                           for classification in children.findall('classification')}
+        for classification in classifications.values():
+            assignments = classification.find('assignments')
+            for assignment in list(assignments):
+                if self.get_assignment_security(assignment) in changed:
+                    assignments.remove(assignment)
+
+        used_colors = {classification.findtext('color') for classification in classifications.values()}
+        colors = cycle([color for color in COLORS if color not in used_colors] or COLORS)
+        rank = max((int(rank.text) for rank in children.iter('rank') if rank.text), default=0)
+        for built_classification in built_children.findall('classification'):
+            name = built_classification.findtext('name')
+            classification = classifications.get(name)
+            if classification is None:
+                # a category that is new for this taxonomy: only changed securities can be in it
+                built_classification.find('color').text = next(colors)
+                children.append(built_classification)
+                classifications[name] = built_classification
+                continue
+            assignments = classification.find('assignments')
+            for assignment in built_classification.find('assignments'):
+                if self.get_assignment_security(assignment) in changed:
+                    rank += 1
+                    assignment.find('rank').text = str(rank)
+                    assignments.append(assignment)
+
+        for classification in children.findall('classification'):
+            # a category holding categories of its own was made by the user, it is kept
+            nested = classification.find('children')
+            if len(classification.find('assignments')) == 0 and (nested is None or len(nested) == 0):
+                children.remove(classification)
+        return True
+
+    def build_taxonomy(self, kind):
+        """build the <taxonomy> element of the kind; the names are escaped when the tree is serialized"""
         securities = self.get_securities()
-        taxonomy_tpl = """
-            <taxonomy>
-                <id>{{ outer_uuid }}</id>
-                <name>{{ kind }}</name>
-                <root>
-                    <id>{{ inner_uuid }}</id>
-                    <name>{{ kind }}</name>
-                    <color>#89afee</color>
-                    <children>
-                        {% for category in categories %}
-                        <classification>
-                            <id>{{ category["uuid"] }}</id>
-                            <name>{{ category["name"] }}</name>
-                            <color>{{ category["color"] }}</color>
-                            <parent reference="../../.."/>
-                            <children/>
-                            <assignments>
-                            {% for assignment in category["assignments"] %}
-                                <assignment>
-                                    <investmentVehicle class="security" reference="{{ assignment["security_xpath"] }}"/>
-                                    <weight>{{ assignment["weight"] }}</weight>
-                                    <rank>{{ assignment["rank"] }}</rank>
-                                </assignment>
-                             {% endfor %}
-                            </assignments>
-                            <weight>0</weight>
-                            <rank>1</rank>
-                        </classification>
-                        {% endfor %}
-                    </children>
-                    <assignments/>
-                    <weight>10000</weight>
-                    <rank>0</rank>
-                </root>
-            </taxonomy>
-            """
-
-        unique_categories = defaultdict(list)
-
-        rank = 1
-
-        for security in securities:
-            security_h = security.holdings
-            security_assignments = security_h.group_by_key(kind)
-
-            for category, weight in security_assignments.items():
-                unique_categories[category].append(
-                    {"security_xpath": self.get_security_xpath_by_uuid(security.UUID), "weight": round(weight * 100),
-                     "rank": rank})
-                rank += 1
-
-        categories = []
-        color = cycle(COLORS)
-        for idx, (category, assignments) in enumerate(unique_categories.items()):
-            cat_weight = 0
-            for assignment in assignments:
-                cat_weight += assignment['weight']
-
-            categories.append(
-                {"name": category, "uuid": str(uuid.uuid4()), "color": next(color), "assignments": assignments,
-                 "weight": cat_weight})
-
-        tax_tpl = Environment(loader=BaseLoader).from_string(taxonomy_tpl)
-        taxonomy_xml = tax_tpl.render(outer_uuid=str(uuid.uuid4()), inner_uuid=str(uuid.uuid4()), kind=kind,
-                                      categories=categories)
-        self.pp.find('.//taxonomies').append(ET.fromstring(taxonomy_xml))
+        with RunReport.phase('aggregate'):
+            matrix = self.get_weight_matrix(kind)
+            self.check_security_index()
+            positions = self.security_positions
+            security_xpaths = [get_security_xpath(positions.get(security.UUID)) for security in securities]
+
+        with RunReport.phase('render'):
+            taxonomy = ET.Element('taxonomy')
+            sub_element(taxonomy, 'id', str(uuid.uuid4()))
+            sub_element(taxonomy, 'name', kind)
+            root = sub_element(taxonomy, 'root')
+            sub_element(root, 'id', get_taxonomy_root_id(kind))
+            sub_element(root, 'name', kind)
+            sub_element(root, 'color', '#89afee')
+            children = sub_element(root, 'children')
+            color = cycle(COLORS)
+            for category, rows, weights, ranks in matrix.assignments():
+                classification = sub_element(children, 'classification')
+                sub_element(classification, 'id', str(uuid.uuid4()))
+                sub_element(classification, 'name', category)
+                sub_element(classification, 'color', next(color))
+                ET.SubElement(classification, 'parent', reference='../../..')
+                sub_element(classification, 'children')
+                assignments = sub_element(classification, 'assignments')
+                for row, weight, rank in zip(rows, weights, ranks):
+                    assignment = sub_element(assignments, 'assignment')
+                    ET.SubElement(assignment, 'investmentVehicle',
+                                  {'class': 'security', 'reference': security_xpaths[row]})
+                    sub_element(assignment, 'weight', str(weight))
+                    sub_element(assignment, 'rank', str(rank))
+                sub_element(classification, 'weight', '0')
+                sub_element(classification, 'rank', '1')
+            sub_element(root, 'assignments')
+            sub_element(root, 'weight', '10000')
+            sub_element(root, 'rank', '0')
+            return taxonomy
+
+    def get_weight_matrix(self, kind):
+        if kind not in self.weight_matrices:
+            self.weight_matrices[kind] = WeightMatrix.from_securities(kind, self.get_securities())
+        return self.weight_matrices[kind]
+
+    def get_position_values(self, securities):
+        """market value of the position in each security: net shares times latest price"""
+        self.check_security_index()
+        prices = [get_latest_price(self.security_elements[self.security_positions[security.UUID]])
+                  for security in securities]
+        return np.array([security.shares for security in securities], dtype=float) * np.array(prices, dtype=float)
+
+    def get_exposure(self, kinds):
+        """look-through exposure of the portfolio to the categories of each taxonomy, in percent
+
+        Each fund contributes its weights in proportion to the market value of its position.
+        """
+        values = self.get_position_values(self.get_securities())
+        return {kind: self.get_weight_matrix(kind).exposure(values) for kind in kinds}
 
     def write_xml(self, output_file):
-        with open(output_file, 'wb') as f:
+        size_hint = get_content_size(self.filepath, self.file_format)
+        with create_portfolio_file(output_file, self.file_format, size_hint) as f:
             self.pp_tree.write(f, encoding="utf-8")
 
     def dump_xml(self):
         print(ET.tostring(self.pp, encoding="unicode"))
 
+    def get_security_references(self):
+        """the securities referenced anywhere in the file, resolved in a single walk (see SecurityReferences)"""
+        if self.references is None:
+            self.references = find_security_references(self.pp)
+        return self.references
+
+    def get_security_candidates(self):
+        """the referenced securities that have an isin, each one once, in the order of their first reference
+
+        Every candidate carries the number of transactions referencing it and the net shares
+        of its portfolio transactions; securities only found in watchlists have neither.
+        """
+        self.check_security_index()
+        candidates = []
+        for position, (transactions, shares) in self.get_security_references().held.items():
+            if position >= len(self.security_elements):
+                continue
+            security = self.get_security(self.security_elements[position], transactions=transactions, shares=shares)
+            if security is not None:
+                candidates.append(security)
+        return candidates
+
     def get_securities(self):
         if self.securities is None:
             self.securities = []
-            sec_xpaths = []
-            for transaction in self.pp.findall('.//portfolio-transaction'):
-                for child in transaction:
-                    if child.tag == "security":
-                        sec_xpaths.append('.//' + child.attrib["reference"].split('/')[-1])
-
-            for sec_xpath in list(set(sec_xpaths)):
-                security = self.get_security(sec_xpath)
-                if security is not None:
-                    security_h = security.load_holdings(self.domain)
-                    if security_h.secid != '':
-                        self.securities.append(security)
+            candidates = self.get_security_candidates()
+
+            # resolve all the secids at once before loading the holdings
+            with RunReport.phase('secid'):
+                Isin2secid.get_secids([security.ISIN for security in candidates], self.domain, self.workers)
+            for security, security_h in zip(candidates, fetch_holdings(candidates, self.domain, self.workers,
+                                                                       self.kinds, self.look_through)):
+                if security_h.secid != '':
+                    self.securities.append(security)
         return self.securities
 
 
+def sub_element(parent, tag, text=None):
+    element = ET.SubElement(parent, tag)
+    element.text = text
+    return element
+
+
+def get_latest_price(security):
+    """latest quote of a security element, 0 if it has none"""
+    latest = security.find('latest')
+    if latest is not None and latest.get('v'):
+        return int(latest.get('v'))
+    prices = security.findall('prices/price')
+    return int(prices[-1].get('v')) if prices else 0
+
+
 def print_class(grouped_holding):
     for key, value in sorted(grouped_holding.items(), reverse=True):
         print(key, "\t\t{:.2f}%".format(value))
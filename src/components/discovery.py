@@ -0,0 +1,99 @@
+import re
+
+# effect of a portfolio transaction on the shares held
+TRANSACTION_SIGNS = {'BUY': 1, 'DELIVERY_INBOUND': 1, 'TRANSFER_IN': 1,
+                     'SELL': -1, 'DELIVERY_OUTBOUND': -1, 'TRANSFER_OUT': -1}
+REFERENCE_STEP_REGEX = re.compile(r"^([^\[\]/]+)(?:\[(\d+)\])?$")
+# sections of the file that do not reference securities: the securities themselves and their
+# price history, and the taxonomies whose assignments are investment vehicles
+UNREFERENCING_SECTIONS = frozenset(['securities', 'taxonomies'])
+
+
+class SecurityReferences:
+    """the securities referenced by a file, each once, in the order of their first reference
+
+    It is fed with the references met during a single pass over the file: those of the
+    portfolio and account transactions, the watchlists, the investment plans... For every
+    security it counts the transactions referencing it and sums the shares of its portfolio
+    transactions. Positions are indexes in the <securities> list of the file.
+    """
+
+    def __init__(self):
+        # xstream id of the securities, for the files written with id references
+        self.ids = dict()
+        # position -> [transactions, shares]
+        self.held = dict()
+
+    def resolve(self, path, reference):
+        """position of the security referenced by the element at path, None if it is not one
+
+        path is the ((tag, index among the siblings of that tag), ...) of the element holding
+        the reference, from the root element down.
+        """
+        if reference.isdigit():
+            return self.ids.get(reference)
+        resolved = list(path)
+        for step in reference.split('/'):
+            if step == '..':
+                if not resolved:
+                    return None
+                resolved.pop()
+            elif step not in ('', '.'):
+                match = REFERENCE_STEP_REGEX.match(step)
+                if match is None:
+                    return None
+                resolved.append((match.group(1), int(match.group(2) or 1)))
+        if len(resolved) != 3 or resolved[1] != ('securities', 1) or resolved[2][0] != 'security':
+            return None
+        return resolved[2][1] - 1
+
+    def add(self, position, transaction=False, shares=0):
+        if position is None:
+            return
+        held = self.held.setdefault(position, [0, 0])
+        if transaction:
+            held[0] += 1
+        held[1] += shares
+
+    def add_reference(self, path, reference, parent, get_field):
+        """add the reference of the security element at path whose parent element is named parent
+
+        get_field(name) returns the text of a field of the parent, to read the type and the
+        shares of a portfolio transaction.
+        """
+        self.add(self.resolve(path, reference), parent.endswith('-transaction'),
+                 get_transaction_shares(parent, get_field))
+
+
+def get_transaction_shares(parent, get_field):
+    """shares added to (or removed from) the position by a portfolio transaction, 0 for other elements"""
+    if parent != 'portfolio-transaction':
+        return 0
+    sign = TRANSACTION_SIGNS.get(get_field('type'))
+    amount = get_field('shares')
+    if sign is None or not amount:
+        return 0
+    return sign * int(amount)
+
+
+def find_security_references(root):
+    """the security references of a parsed file, resolved in a single walk that skips the price history"""
+    references = SecurityReferences()
+    for position, security in enumerate(root.findall('securities/security')):
+        if security.get('id') is not None:
+            references.ids[security.get('id')] = position
+    stack = [(root, ((root.tag, 1),))]
+    while stack:
+        element, path = stack.pop()
+        counts = dict()
+        children = []
+        for child in element:
+            index = counts[child.tag] = counts.get(child.tag, 0) + 1
+            if child.tag == 'security' and child.get('reference') is not None:
+                references.add_reference(path + ((child.tag, index),), child.get('reference'), element.tag,
+                                         element.findtext)
+            elif len(child) and not (element is root and child.tag in UNREFERENCING_SECTIONS):
+                children.append((child, path + ((child.tag, index),)))
+        # depth first, in document order
+        stack.extend(reversed(children))
+    return references
@@ -0,0 +1,153 @@
+import re
+from typing import NamedTuple
+
+from src.utils.taxonomies import taxonomies
+
+NON_CATEGORIES = frozenset(['avgMarketCap', 'portfolioDate', 'name', 'masterPortfolioId'])
+# holdingTypeId of the holdings that are funds themselves -> type of their SAL endpoints
+FUND_HOLDING_TYPES = {'FO': 'fund', 'FC': 'fund', 'FE': 'etf'}
+SIMPLE_PATH_REGEX = re.compile(r"^\$(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+
+class Extraction(NamedTuple):
+    categories: list
+    percentages: list
+    value: object
+    unmapped: list
+
+
+class FundHolding(NamedTuple):
+    secid: str
+    secid_type: str
+    name: str
+    weight: float
+
+
+class TaxonomyExtractor:
+    """compiled form of a taxonomy definition of src/utils/taxonomies.py
+
+    Plain '$.a.b' paths are resolved with direct dict lookups; the jsonpath engine is
+    only imported and the path parsed the first time a path with wildcards is used.
+    """
+
+    def __init__(self, name, taxonomy):
+        self.name = name
+        self.url = taxonomy['url']
+        self.component = taxonomy['component']
+        self.path = taxonomy['jsonpath']
+        self.jsonpath = None
+        if SIMPLE_PATH_REGEX.match(taxonomy['jsonpath']):
+            self.path_keys = tuple(key for key in taxonomy['jsonpath'][1:].split('.') if key)
+        else:
+            self.path_keys = None
+        self.category_field = taxonomy['category']
+        self.percent_field = taxonomy['percent']
+        self.mapping = dict(taxonomy.get('map', {}))
+        self.xray_mapping = dict(taxonomy.get('map2', {}))
+        self.xray_table = taxonomy['table']
+        self.xray_column = taxonomy['column']
+
+    def find(self, response):
+        """return the values matched by the jsonpath"""
+        if self.path_keys is None:
+            if self.jsonpath is None:
+                from jsonpath_ng import parse
+                self.jsonpath = parse(self.path)
+            return [match.value for match in self.jsonpath.find(response)]
+        value = response
+        for key in self.path_keys:
+            if not isinstance(value, dict) or key not in value:
+                return []
+            value = value[key]
+        return [value]
+
+    def extract(self, response):
+        """categories and percentages of a SAL response, in a single pass over the matches"""
+        matches = self.find(response)
+        keys = []
+        percentages = []
+        if self.category_field == '':
+            if len(matches) != 1:
+                raise ValueError(f"{len(matches)} matches for {self.name}")
+            # the matched object holds the categories
+            value = matches[0]
+            keys = [key for key in value if key not in NON_CATEGORIES]
+            percent_field = self.percent_field
+            if percent_field != '':
+                if value[keys[0]][percent_field] is not None:
+                    percentages = [float(value[key][percent_field]) for key in keys]
+            elif value[keys[0]] is not None:
+                percentages = [float(value[key]) for key in keys]
+        else:
+            # every match is a category
+            value = matches
+            keys = [match[self.category_field] for match in matches]
+            if len(matches) != 0 and matches[0].get(self.percent_field, "") != "":
+                percentages = [float(match[self.percent_field]) for match in matches]
+
+        unmapped = []
+        if self.mapping:
+            categories = []
+            mapped_percentages = []
+            for idx, key in enumerate(keys):
+                category = self.mapping.get(key)
+                if category is None:
+                    unmapped.append(key)
+                else:
+                    categories.append(category)
+                    if percentages:
+                        mapped_percentages.append(percentages[idx])
+            percentages = mapped_percentages
+        else:
+            # capitalize first letter if not mapping
+            categories = [key[0].upper() + key[1:] for key in keys]
+        return Extraction(categories, percentages, value, unmapped)
+
+    def map_xray(self, categories, percentages):
+        """categories and percentages of an x-ray table mapped as the SAL ones, and the labels not mapped"""
+        if not self.xray_mapping:
+            return categories, percentages, []
+        mapped_categories = []
+        mapped_percentages = []
+        unmapped = []
+        for category, percentage in zip(categories, percentages):
+            mapped = self.xray_mapping.get(category)
+            if mapped is None:
+                unmapped.append(category)
+            else:
+                mapped_categories.append(mapped)
+                mapped_percentages.append(percentage)
+        return mapped_categories, mapped_percentages, unmapped
+
+
+def extract_fund_holdings(response):
+    """the holdings of a SAL holding response that are funds, from all its holding pages"""
+    funds = []
+    for page in response.values():
+        if not isinstance(page, dict) or not isinstance(page.get('holdingList'), list):
+            continue
+        for holding in page['holdingList']:
+            secid_type = FUND_HOLDING_TYPES.get(holding.get('holdingTypeId'))
+            if secid_type is None or not holding.get('secId') or holding.get('weighting') is None:
+                continue
+            funds.append(FundHolding(holding['secId'], secid_type, holding.get('securityName') or holding['secId'],
+                                     float(holding['weighting'])))
+    return funds
+
+
+def compile_taxonomies(definitions):
+    return {name: TaxonomyExtractor(name, taxonomy) for name, taxonomy in definitions.items()}
+
+
+def select_taxonomies(names):
+    """taxonomy names of a comma separated list, in any case, in the order of the definitions"""
+    known = {name.lower(): name for name in taxonomies}
+    selected = set()
+    for name in names.split(','):
+        if name.strip().lower() not in known:
+            raise ValueError(f"unknown taxonomy '{name.strip()}', choose from {', '.join(taxonomies)}")
+        selected.add(known[name.strip().lower()])
+    return [name for name in taxonomies if name in selected]
+
+
+extractors = compile_taxonomies(taxonomies)
@@ -0,0 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.CONSTANTS import WORKERS_DEFAULT
+
+
+def fetch_holdings(securities, domain, workers=WORKERS_DEFAULT, kinds=None, look_through=0):
+    """load the holdings of the kinds (all if None) of every security, in parallel when workers > 1
+
+    The reports are returned in the same order as the securities, so the result
+    does not depend on the number of workers. With look_through > 0 the funds held by the
+    securities are expanded down to that many levels (see LookThrough).
+    """
+    load_kinds = kinds
+    if look_through and kinds is not None and 'Holding' not in kinds:
+        # the held funds are read from the holdings
+        load_kinds = list(kinds) + ['Holding']
+    if workers <= 1 or len(securities) <= 1:
+        reports = [security.load_holdings(domain, load_kinds) for security in securities]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            reports = list(executor.map(lambda security: security.load_holdings(domain, load_kinds), securities))
+    if look_through:
+        from src.components.lookthrough import LookThrough
+        LookThrough(domain, kinds, look_through, workers).expand(reports)
+    return reports
@@ -0,0 +1,79 @@
+import zipfile
+from contextlib import contextmanager
+
+PLAIN_XML = 'xml'
+ZIPPED_XML = 'zipped-xml'
+# entry of the zipped xml saved by portfolio performance, and of its binary format
+ZIP_ENTRY = 'data.xml'
+BINARY_ZIP_ENTRY = 'data.portfolio'
+ZIP_SIGNATURE = b'PK\x03\x04'
+BINARY_SIGNATURE = b'PPPBV1'
+ENCRYPTED_SIGNATURE = b'PORTFOLIO'
+# name of the output file when none is given
+OUTPUT_FILES = {PLAIN_XML: 'pp_classified.xml', ZIPPED_XML: 'pp_classified.portfolio'}
+# extensions of the files classified from a directory
+EXTENSIONS = ('.xml', '.portfolio')
+
+
+class UnsupportedFormatError(ValueError):
+    pass
+
+
+def detect_format(path):
+    """format of a portfolio performance file, read from its first bytes rather than its extension
+
+    Plain and zipped xml are supported. The binary (protobuf) format and the encrypted files
+    raise UnsupportedFormatError, as does a zip that holds no portfolio. Reading and writing
+    the binary format is a follow-up, see docs/binary-format.md.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(len(ENCRYPTED_SIGNATURE))
+    if head.startswith(ENCRYPTED_SIGNATURE):
+        raise UnsupportedFormatError("the file is encrypted, save it in Portfolio Performance as unencrypted xml")
+    if head.startswith(BINARY_SIGNATURE):
+        raise UnsupportedFormatError("the file is in the binary format, save it in Portfolio Performance as xml")
+    if not head.startswith(ZIP_SIGNATURE):
+        return PLAIN_XML
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+    if ZIP_ENTRY in names:
+        return ZIPPED_XML
+    if BINARY_ZIP_ENTRY in names:
+        raise UnsupportedFormatError("the file is in the binary format, save it in Portfolio Performance as xml")
+    raise UnsupportedFormatError("the file is a zip file without a portfolio in it")
+
+
+def get_content_size(path, file_format):
+    """size of the xml of the file, uncompressed"""
+    if file_format == ZIPPED_XML:
+        with zipfile.ZipFile(path) as archive:
+            return archive.getinfo(ZIP_ENTRY).file_size
+    with open(path, 'rb') as f:
+        return f.seek(0, 2)
+
+
+@contextmanager
+def open_portfolio_file(path, file_format):
+    """binary stream of the xml of the file, decompressed while it is read"""
+    if file_format == PLAIN_XML:
+        with open(path, 'rb') as f:
+            yield f
+        return
+    with zipfile.ZipFile(path) as archive, archive.open(ZIP_ENTRY) as f:
+        yield f
+
+
+@contextmanager
+def create_portfolio_file(path, file_format, size_hint=0):
+    """binary stream writing the xml of a file in the format, compressed while it is written
+
+    size_hint is the expected size of the xml; above 2 GiB the zip entry needs the zip64
+    extensions, which must be known before it is written.
+    """
+    if file_format == PLAIN_XML:
+        with open(path, 'wb') as f:
+            yield f
+        return
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive, \
+            archive.open(ZIP_ENTRY, 'w', force_zip64=size_hint >= zipfile.ZIP64_LIMIT // 2) as f:
+        yield f
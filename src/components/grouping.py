@@ -0,0 +1,56 @@
+import sys
+from array import array
+from collections.abc import Mapping
+
+
+class Grouping(Mapping):
+    """weights in percent of the categories of a fund for one taxonomy, frozen once fetched
+
+    The category names are interned, so that all the funds share a single copy of each, and
+    the weights are packed in an array of doubles instead of a dict of float objects. The
+    groupings are small, looking a category up by its position is as fast as hashing it.
+    """
+    __slots__ = ('categories', 'weights')
+
+    def __init__(self, categories=(), weights=()):
+        self.categories = tuple(sys.intern(category) for category in categories)
+        self.weights = array('d', weights)
+
+    @staticmethod
+    def from_dict(weights):
+        return Grouping(weights.keys(), weights.values())
+
+    def __getitem__(self, category):
+        try:
+            return self.weights[self.categories.index(category)]
+        except ValueError:
+            raise KeyError(category) from None
+
+    def __iter__(self):
+        return iter(self.categories)
+
+    def __len__(self):
+        return len(self.categories)
+
+    def __contains__(self, category):
+        return category in self.categories
+
+    def items(self):
+        return zip(self.categories, self.weights)
+
+    def to_dict(self):
+        return dict(zip(self.categories, self.weights))
+
+    def __repr__(self):
+        return f"Grouping({self.to_dict()!r})"
+
+
+def freeze_groupings(groupings):
+    """the groupings of a fund by kind, each as a Grouping"""
+    return {kind: grouping if isinstance(grouping, Grouping) else Grouping.from_dict(grouping)
+            for kind, grouping in groupings.items()}
+
+
+def thaw_groupings(groupings):
+    """the groupings of a fund by kind as plain dicts, to be serialized"""
+    return {kind: dict(grouping.items()) for kind, grouping in groupings.items()}
@@ -1,26 +1,43 @@
-import re
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import NamedTuple
-from xml.sax.saxutils import escape
 
 import requests
-from bs4 import BeautifulSoup
-from jsonpath_ng import parse
 
+from src.components.bearer_token import BearerToken
+from src.components.classification_store import ClassificationStore
+from src.components.extractors import extractors, extract_fund_holdings
+from src.components.grouping import Grouping
 from src.components.isin2secid import Isin2secid
-from src.utils.taxonomies import taxonomies
+from src.components.secid2fc import Secid2fc
+from src.components.transport import Transport
+from src.components.xray import parse_xray_tables, extract_xray_table, xray_long_equity
+from src.utils.CONSTANTS import REVALIDATION_WORKERS
+from src.utils.run_report import RunReport
 
 
 class Security:
+    __slots__ = ('name', 'ISIN', 'secid', 'UUID', 'transactions', 'shares', 'holdings')
 
-    def __init__(self, **kwargs):
-        self.__dict__.update(kwargs)
-        self.holdings = []
+    def __init__(self, name=None, ISIN=None, secid=None, UUID=None, transactions=0, shares=0):
+        self.name = name
+        self.ISIN = ISIN
+        self.secid = secid
+        self.UUID = UUID
+        # portfolio transactions referencing the security and net shares held
+        self.transactions = transactions
+        self.shares = shares
+        self.holdings = None
 
-    def load_holdings(self, domain):
-        if len(self.holdings) == 0:
-            self.holdings = SecurityHoldingReport(domain)
-            self.holdings.load(isin=self.ISIN, secid=self.secid)
+    def load_holdings(self, domain, kinds=None):
+        """load the groupings of the kinds (all if None), the report is kept for later calls"""
+        with RunReport.security(self.ISIN):
+            if self.holdings is None:
+                self.holdings = SecurityHoldingReport(domain)
+                self.holdings.load(isin=self.ISIN, secid=self.secid, kinds=kinds)
+            else:
+                self.holdings.load_kinds(kinds)
         return self.holdings
 
 
@@ -39,43 +56,46 @@ class Holding(NamedTuple):
 
 
 class SecurityHoldingReport:
+    # a long-running server keeps thousands of reports, their groupings are Grouping once loaded
+    __slots__ = ('isin', 'secid', 'secid_type', 'secid_domain', 'domain', 'portfolio_date', 'grouping',
+                 'long_equity', 'funds', 'expanded', 'fetched_at', 'stale')
+
     def __init__(self, domain):
+        self.isin = None
         self.secid = ''
+        self.secid_type = None
+        self.secid_domain = None
         self.domain = domain
-        pass
+        self.portfolio_date = None
+        self.grouping = dict()
+        # share of long stocks, by which the groupings other than Asset-Type are scaled
+        self.long_equity = None
+        # funds held by the fund (FundHolding), read along with Holding; None until Holding is loaded
+        self.funds = None
+        # groupings with the held funds expanded (see LookThrough), used instead of the own ones
+        self.expanded = dict()
+        # when the stored groupings were fetched, None if there are none: the kinds added keep that age
+        self.fetched_at = None
+        # served from the store past its expiry, it is fetched again in the background
+        self.stale = False
 
     def get_bearer_token(self, secid, domain):
         # the secid can change for retrieval purposes
         # find the retrieval secid
-        headers = {
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36'}
-        url = f'https://www.morningstar.{domain}/{domain}/funds/snapshot/snapshot.aspx?id={secid}'
-        response = requests.get(url, headers=headers)
-        secid_regexp = r"var FC =  '(.*)';"
-        matches = re.findall(secid_regexp, response.text)
-        if len(matches) > 0:
-            secid_to_search = matches[0]
-        else:
-            secid_to_search = secid
-
-        # get the bearer token for the new secid
-        url = f'https://www.morningstar.{domain}/Common/funds/snapshot/PortfolioSAL.aspx'
-        payload = {'FC': secid_to_search}
-        response = requests.get(url, headers=headers, params=payload)
-        token_regex = r"const maasToken \=\s\"(.+)\""
-        resultstringtoken = re.findall(token_regex, response.text)[0]
-        return resultstringtoken, secid_to_search
-
-    def calculate_grouping(self, categories, percentages, grouping_name, long_equity):
-        for category_name, percentage in zip(categories, percentages):
-            self.grouping[grouping_name][escape(category_name)] = self.grouping[grouping_name].get(
-                escape(category_name), 0) + percentage
+        secid_to_search = Secid2fc.get_fc(secid, domain)
+        # the bearer token is shared by all the securities of the domain
+        return BearerToken.get(domain, secid_to_search), secid_to_search
 
-        if grouping_name != 'Asset-Type':
-            self.grouping[grouping_name] = {k: v * long_equity for k, v in self.grouping[grouping_name].items()}
+    def calculate_grouping(self, categories, percentages, grouping_name):
+        grouping = self.grouping[grouping_name]
+        for category_name, percentage in zip(categories, percentages):
+            grouping[category_name] += percentage
 
-    def load(self, isin, secid):
-        secid, secid_type, domain = Isin2secid.get_secid(isin, self.domain)
+    def load(self, isin, secid, kinds=None):
+        """resolve the secid of the isin and load the groupings of the kinds (all if None)"""
+        self.isin = isin
+        with RunReport.phase('secid'):
+            secid, secid_type, domain = Isin2secid.get_secid(isin, self.domain)
         if secid == '':
             print(
                 f"isin {isin} not found in Morningstar for domain '{self.domain}', skipping it... Try another domain with -d <domain>")
@@ -83,115 +103,229 @@ class SecurityHoldingReport:
         elif secid_type == "stock":
             print(f"isin {isin} is a stock, skipping it...")
             return
+        self.load_secid(secid, secid_type, domain, kinds)
+
+    def load_secid(self, secid, secid_type, domain, kinds=None):
+        """load the groupings of the kinds (all if None) of a known secid"""
         self.secid = secid
-        bearer_token, secid = self.get_bearer_token(secid, domain)
-        print(f"Retrieving data for {secid_type} {isin} ({secid}) using domain '{domain}'...")
-        headers = {'accept': '*/*', 'accept-encoding': 'gzip, deflate, br',
+        self.secid_type = secid_type
+        self.secid_domain = domain
+        stored = ClassificationStore.get(secid)
+        if stored is not None:
+            # the stored grouping can be shared, the kinds loaded later are added to a copy
+            self.grouping = dict(stored.grouping)
+            self.long_equity = stored.long_equity
+            self.funds = stored.funds
+            self.portfolio_date = stored.portfolio_date
+            self.fetched_at = stored.fetched_at
+            self.stale = stored.stale
+        self.load_kinds(kinds)
+        if self.stale:
+            Revalidation.submit(self)
+
+    def load_kinds(self, kinds=None):
+        """fetch the groupings of the kinds that are not loaded yet
+
+        Only the SAL endpoints of those kinds are requested, plus Asset-Type when the share of
+        long stocks is still unknown. The x-ray page is only downloaded if one of them fails.
+        """
+        if self.secid == '':
+            return
+        missing = [kind for kind in extractors if kind not in self.grouping and (kinds is None or kind in kinds)]
+        if not missing:
+            return
+        if self.long_equity is None and 'Asset-Type' not in missing:
+            # the other groupings are scaled by the share of long stocks read along with Asset-Type
+            missing.insert(0, 'Asset-Type')
+        secid, secid_type, domain = self.secid, self.secid_type, self.secid_domain
+        try:
+            with RunReport.phase('token'):
+                bearer_token, secid = self.get_bearer_token(secid, domain)
+        except requests.RequestException as e:
+            print(f"  no access token for secid {secid}: {e!r}")
+            return
+        print(f"Retrieving data for {secid_type} {self.isin} ({secid}) using domain '{domain}'...")
+        headers = {'accept': '*/*',
                    'accept-language': 'fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7',
                    'Authorization': f'Bearer {bearer_token}', }
 
         params = {'premiumNum': '10', 'freeNum': '10', 'languageId': 'de-DE', 'locale': 'en', 'clientId': 'MDC_intl',
                   'benchmarkId': 'category', 'version': '3.60.0', }
 
-        self.grouping = dict()
-        for taxonomy in taxonomies:
-            self.grouping[taxonomy] = defaultdict(float)
+        for grouping_name in missing:
+            self.grouping[grouping_name] = defaultdict(float)
+        if 'Holding' in missing:
+            # the x-ray page does not tell which holdings are funds
+            self.funds = []
 
-        non_categories = ['avgMarketCap', 'portfolioDate', 'name', 'masterPortfolioId']
         json_not_found = False
-        for grouping_name, taxonomy in taxonomies.items():
-            params['component'] = taxonomy['component']
-            url = taxonomy['url'] + secid + "/data"
-            # use etf or fund endpoint
-            url = url.replace("{type}", secid_type)
-            resp = requests.get(url, params=params, headers=headers)
-            if resp.status_code == 401:
-                json_not_found = True
-                print(f"  {grouping_name} for secid {secid} will be retrieved from x-ray...")
-                continue
-            try:
-                response = resp.json()
-                jsonpath = parse(taxonomy['jsonpath'])
-                percent_field = taxonomy['percent']
-                # single match of the jsonpath means the path contains the categories
-                if len(jsonpath.find(response)) == 1:
-                    value = jsonpath.find(response)[0].value
-                    keys = [key for key in value if key not in non_categories]
-
-                    if percent_field != "":
-                        if value[keys[0]][percent_field] is not None:
-                            percentages = [float(value[key][percent_field]) for key in keys]
-                        else:
-                            percentages = []
-                    else:
-                        if value[keys[0]] is not None:
-                            percentages = [float(value[key]) for key in keys]
-                        else:
-                            percentages = []
+        for grouping_name in missing:
+            extractor = extractors[grouping_name]
+            with RunReport.phase('sal:' + grouping_name):
+                params['component'] = extractor.component
+                url = extractor.url + secid + "/data"
+                # use etf or fund endpoint
+                url = url.replace("{type}", secid_type)
+                try:
+                    resp = Transport.get(url, params=params, headers=headers)
+                    if resp.status_code == 401:
+                        # the token may have expired, retry once with a renewed one
+                        renewed_token = BearerToken.refresh(domain, bearer_token, secid)
+                        if renewed_token != bearer_token:
+                            bearer_token = renewed_token
+                            headers['Authorization'] = f'Bearer {bearer_token}'
+                            resp = Transport.get(url, params=params, headers=headers)
+                    if resp.status_code != 401:
+                        # the last answer of the retries is an error
+                        resp.raise_for_status()
+                except requests.RequestException as e:
+                    json_not_found = True
+                    print(f"  {grouping_name} for secid {secid} failed ({e!r}), it will be retrieved from x-ray...")
+                    continue
+                if resp.status_code == 401:
+                    json_not_found = True
+                    print(f"  {grouping_name} for secid {secid} will be retrieved from x-ray...")
+                    continue
+                try:
+                    response = resp.json()
+                    extraction = extractor.extract(response)
+                    value = extraction.value
+                    if grouping_name == 'Holding':
+                        self.funds = extract_fund_holdings(response)
+                    if isinstance(value, dict) and value.get('portfolioDate'):
+                        # the oldest portfolio of the groupings is the first to be replaced
+                        if self.portfolio_date is None or value['portfolioDate'] < self.portfolio_date:
+                            self.portfolio_date = value['portfolioDate']
 
                     if grouping_name == 'Asset-Type':
                         try:
-                            long_equity = (float(value.get('assetAllocEquity', {}).get('longAllocation', 0)) + float(
+                            self.long_equity = (float(value.get('assetAllocEquity', {}).get('longAllocation', 0)) + float(
                                 value.get('AssetAllocNonUSEquity', {}).get('longAllocation', 0)) + float(
                                 value.get('AssetAllocUSEquity', {}).get('longAllocation', 0))) / 100
                         except TypeError:
                             print(f"  No information on {grouping_name} for {secid}")
-                else:
-                    # every match is a category
-                    value = jsonpath.find(response)
-                    keys = [key.value[taxonomy['category']] for key in value]
-                    if len(value) == 0 or value[0].value.get(taxonomy['percent'], "") == "":
-                        print(f"  percentages not found for {grouping_name} for {secid}")
-                    else:
-                        percentages = [float(key.value[taxonomy['percent']]) for key in value]
+                            # the share of long stocks is read from x-ray
+                            json_not_found = True
 
-                # Map names if there is a map
-                if len(taxonomy.get('map', {})) != 0:
-                    categories = [taxonomy['map'][key] for key in keys if key in taxonomy['map'].keys()]
-                    unmapped = [key for key in keys if key not in taxonomy['map'].keys()]
-                    if unmapped:
-                        print(f"  Categories not mapped: {unmapped} for {secid}")
-                else:
-                    # capitalize first letter if not mapping
-                    categories = [key[0].upper() + key[1:] for key in keys]
+                    if extraction.unmapped:
+                        print(f"  Categories not mapped: {extraction.unmapped} for {secid}")
 
-                if percentages:
-                    self.calculate_grouping(categories, percentages, grouping_name, long_equity)
+                    if extraction.percentages:
+                        self.calculate_grouping(extraction.categories, extraction.percentages, grouping_name)
+                    else:
+                        print(f"  percentages not found for {grouping_name} for {secid}")
 
-            except Exception:
-                print(f"  Problem with {grouping_name} for secid {secid} in PortfolioSAL...")
-                json_not_found = True
+                except Exception:
+                    print(f"  Problem with {grouping_name} for secid {secid} in PortfolioSAL...")
+                    json_not_found = True
 
         if json_not_found:
-            non_categories = ['Defensive', 'Cyclical', 'Sensitive', 'Greater Europe', 'Americas', 'Greater Asia', ]
-            url = "https://lt.morningstar.com/j2uwuwirpv/xray/default.aspx?LanguageId=en-EN&PortfolioType=2&SecurityTokenList=" + secid + "]2]0]FOESP%24%24ALL_1340&values=100"
-            resp = requests.get(url, headers=headers)
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            for grouping_name, taxonomy in taxonomies.items():
-                if grouping_name in self.grouping:
-                    continue
-                table = soup.select("table.ms_data")[taxonomy['table']]
-                trs = table.select("tr")[1:]
-                if grouping_name == 'Asset-Type':
-                    long_equity = float(trs[0].select("td")[0].text.replace(",", ".")) / 100
-                categories = []
-                percentages = []
-                for tr in trs:
-                    if len(tr.select('th')) > 0:
-                        header = tr.th
-                    else:
-                        header = tr.td
-                    if tr.text != '' and header.text not in non_categories:
-                        categories.append(header.text)
-                        if len(tr.select("td")) > taxonomy['column']:
-                            percentages.append(float(
-                                '0' + tr.select("td")[taxonomy['column']].text.replace(",", ".").replace("-", "")))
-                        else:
-                            percentages.append(0.0)
-                if len(taxonomy.get('map2', {})) != 0:
-                    categories = [taxonomy['map2'][key] for key in categories]
-
-                self.calculate_grouping(categories, percentages, grouping_name, long_equity)
+            with RunReport.phase('xray'):
+                url = "https://lt.morningstar.com/j2uwuwirpv/xray/default.aspx?LanguageId=en-EN&PortfolioType=2&SecurityTokenList=" + secid + "]2]0]FOESP%24%24ALL_1340&values=100"
+                try:
+                    resp = Transport.get(url, headers=headers)
+                except requests.RequestException as e:
+                    # nothing is stored, the security is fetched again on the next run
+                    print(f"  x-ray for secid {secid} failed: {e!r}")
+                    self.freeze(missing)
+                    return
+                if resp.status_code != 200:
+                    print(f"  x-ray for secid {secid} failed with status {resp.status_code}")
+                    self.freeze(missing)
+                    return
+                tables = parse_xray_tables(resp.text)
+                try:
+                    if self.long_equity is None:
+                        self.long_equity = xray_long_equity(tables[extractors['Asset-Type'].xray_table])
+                    for grouping_name in missing:
+                        if self.grouping[grouping_name]:
+                            # already retrieved from PortfolioSAL
+                            continue
+                        extractor = extractors[grouping_name]
+                        rows = tables[extractor.xray_table]
+                        categories, percentages = extract_xray_table(rows, extractor.xray_column)
+                        categories, percentages, unmapped = extractor.map_xray(categories, percentages)
+                        if unmapped:
+                            print(f"  Categories not mapped: {unmapped} for {secid}")
+
+                        self.calculate_grouping(categories, percentages, grouping_name)
+                except (IndexError, ValueError) as e:
+                    # an error page or a fund x-ray does not cover: the groupings still missing stay empty
+                    print(f"  x-ray for secid {secid} has not the expected tables ({len(tables)} found): {e!r}")
+                    self.freeze(missing)
+                    return
+
+        self.freeze(missing)
+        if not self.stale:
+            # a stale report is stored by its revalidation
+            self.fetched_at = ClassificationStore.put(self.secid, self.portfolio_date, self.grouping, self.long_equity,
+                                                      self.funds, self.fetched_at)
+
+    def freeze(self, kinds):
+        """replace the groupings of the kinds, summed up in dicts while they are fetched, by Grouping"""
+        for kind in kinds:
+            self.grouping[kind] = Grouping.from_dict(self.grouping[kind])
+
+    def get_grouping(self, key):
+        """unscaled grouping of the kind, fetched if it was not loaded yet"""
+        if key in self.expanded:
+            return self.expanded[key]
+        if key not in self.grouping:
+            with RunReport.security(self.isin):
+                self.load_kinds([key])
+        return self.grouping.get(key, {})
 
     def group_by_key(self, key):
-        return self.grouping[key]
+        grouping = self.get_grouping(key)
+        if key == 'Asset-Type' or self.long_equity is None:
+            return grouping
+        return {category: weight * self.long_equity for category, weight in grouping.items()}
+
+
+class Revalidation:
+    """fetches again in the background the stale classifications served from the store
+
+    The run goes on with the stale groupings while the fresh ones are fetched into the store
+    for the next runs, each secid once at a time. wait() lets the pending revalidations end,
+    it is called before the store is closed.
+    """
+    enabled = True
+    executor = None
+    pending = set()
+    lock = threading.Lock()
+
+    @staticmethod
+    def submit(report):
+        with Revalidation.lock:
+            if not Revalidation.enabled or report.secid in Revalidation.pending:
+                return
+            Revalidation.pending.add(report.secid)
+            if Revalidation.executor is None:
+                Revalidation.executor = ThreadPoolExecutor(max_workers=REVALIDATION_WORKERS,
+                                                           thread_name_prefix='revalidation')
+            Revalidation.executor.submit(Revalidation.revalidate, report.isin, report.domain, report.secid,
+                                         report.secid_type, report.secid_domain, list(report.grouping))
+
+    @staticmethod
+    def revalidate(isin, domain, secid, secid_type, secid_domain, kinds):
+        fresh = SecurityHoldingReport(domain)
+        fresh.isin = isin
+        fresh.secid = secid
+        fresh.secid_type = secid_type
+        fresh.secid_domain = secid_domain
+        try:
+            with RunReport.security(isin):
+                fresh.load_kinds(kinds)
+        except Exception as e:
+            print(f"  revalidation of secid {secid} failed: {e!r}")
+        finally:
+            with Revalidation.lock:
+                Revalidation.pending.discard(secid)
+
+    @staticmethod
+    def wait():
+        with Revalidation.lock:
+            executor = Revalidation.executor
+            Revalidation.executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -1,45 +1,186 @@
 import json
 import os
 import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+from src.components.transport import Transport
+from src.utils.CONSTANTS import SECID_STORE_PATH, SECID_NEGATIVE_TTL, WORKERS_DEFAULT
+from src.utils.run_report import RunReport
+from src.utils.lru import LRUCache
+
 
 class Isin2secid:
-    mapping = dict()
+    """isin -> 'secid|type|domain' mapping kept in an sqlite database
+
+    Every search result is written immediately in its own transaction, so parallel runs
+    share what they find without overwriting each other. ISINs that are not found are
+    stored per domain with an expiry, so they are not searched again on every run.
+    The rows are read when their isin is looked up, not when the database is opened.
+    A found secid is used whatever the domain, since the Morningstar apis do not depend on it.
+    The entries kept in memory are limited to cache_size (no limit if None).
+    """
+    cache_size = None
+    mapping = LRUCache()
+    misses = LRUCache()
+    connection = None
+    lock = threading.Lock()
 
     @staticmethod
-    def load_cache():
-        if os.path.exists("isin2secid.json"):
-            with open("isin2secid.json", "r") as f:
-                try:
-                    Isin2secid.mapping = json.load(f)
-                except json.JSONDecodeError:
-                    print("Invalid json file")
+    def load_cache(path=SECID_STORE_PATH):
+        with Isin2secid.lock:
+            if Isin2secid.connection is not None:
+                Isin2secid.connection.close()
+            connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS secids (
+                                      isin TEXT NOT NULL,
+                                      domain TEXT NOT NULL,
+                                      secid TEXT NOT NULL,
+                                      secid_type TEXT NOT NULL,
+                                      fetched_at REAL NOT NULL,
+                                      expires_at REAL,
+                                      PRIMARY KEY (isin, domain))""")
+            Isin2secid.connection = connection
+            if connection.execute("SELECT COUNT(*) FROM secids").fetchone()[0] == 0:
+                Isin2secid.import_json("isin2secid.json")
+            Isin2secid.mapping = LRUCache(Isin2secid.cache_size)
+            Isin2secid.misses = LRUCache(Isin2secid.cache_size)
+
+    @staticmethod
+    def import_json(path):
+        """take over the mapping of the json file used by previous versions"""
+        if not os.path.exists(path):
+            return
+        with open(path, "r") as f:
+            try:
+                mapping = json.load(f)
+            except json.JSONDecodeError:
+                print("Invalid json file")
+                return
+        now = time.time()
+        rows = []
+        for isin, secid_type_domain in mapping.items():
+            fields = secid_type_domain.split("|")
+            if len(fields) == 3 and fields[0] != '':
+                rows.append((isin, fields[2], fields[0], fields[1], now, None))
+        with Isin2secid.connection:
+            Isin2secid.connection.execute("BEGIN IMMEDIATE")
+            Isin2secid.connection.executemany("INSERT OR IGNORE INTO secids VALUES (?, ?, ?, ?, ?, ?)", rows)
 
     @staticmethod
     def save_cache():
-        with open("isin2secid.json", "w") as f:
-            json.dump(Isin2secid.mapping, f, indent=1, sort_keys=True)
+        # every entry is already committed when it is found
+        with Isin2secid.lock:
+            if Isin2secid.connection is not None:
+                Isin2secid.connection.close()
+                Isin2secid.connection = None
+
+    @staticmethod
+    def prune():
+        """remove the expired misses, return how many were removed"""
+        with Isin2secid.lock:
+            if Isin2secid.connection is None:
+                return 0
+            removed = Isin2secid.connection.execute(
+                "DELETE FROM secids WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)).rowcount
+            Isin2secid.connection.execute("VACUUM")
+        return removed
+
+    @staticmethod
+    def remember(isin, domain, secid, secid_type, expires_at):
+        if secid != '':
+            Isin2secid.mapping.setdefault(isin, secid + "|" + secid_type + "|" + domain)
+        elif expires_at is not None and expires_at > time.time():
+            Isin2secid.misses[(isin, domain)] = expires_at
+
+    @staticmethod
+    def lookup(isin, domain):
+        """cached 'secid|type|domain' of the isin, '||' for a known miss, None if it has to be searched"""
+        with Isin2secid.lock:
+            cached_secid = Isin2secid.mapping.get(isin)
+            if cached_secid is None and Isin2secid.connection is not None:
+                # another run may have found it in the meantime
+                for row in Isin2secid.connection.execute(
+                        "SELECT isin, domain, secid, secid_type, expires_at FROM secids WHERE isin = ?", (isin,)):
+                    Isin2secid.remember(*row)
+                cached_secid = Isin2secid.mapping.get(isin)
+            if cached_secid is not None and len(cached_secid.split("|")) >= 3:
+                return cached_secid
+            if Isin2secid.misses.get((isin, domain), 0) > time.time():
+                return '||'
+        return None
+
+    @staticmethod
+    def store(isin, domain, secid, secid_type):
+        now = time.time()
+        expires_at = None if secid != '' else now + SECID_NEGATIVE_TTL
+        with Isin2secid.lock:
+            Isin2secid.remember(isin, domain, secid, secid_type, expires_at)
+            if Isin2secid.connection is not None:
+                Isin2secid.connection.execute("INSERT OR REPLACE INTO secids VALUES (?, ?, ?, ?, ?, ?)",
+                                              (isin, domain, secid, secid_type, now, expires_at))
+
+    @staticmethod
+    def search(isin, domain):
+        url = f"https://www.morningstar.{domain}/en/util/SecuritySearch.ashx"
+        payload = {'q': isin, 'preferedList': '', 'source': 'nav', 'moduleId': 6, 'ifIncludeAds': False,
+                   'usrtType': 'v'}
+        headers = {'accept': '*/*',
+                   'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36', }
+        try:
+            resp = Transport.post(url, data=payload, headers=headers)
+            # the last answer of the retries is an error
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            # not remembered as a miss, it is searched again on the next run
+            print(f"isin {isin} could not be searched: {e!r}")
+            return '||'
+        response = resp.content.decode('utf-8')
+        if response:
+            match = re.search('\\{"i":"([^"]+)"', response)
+            fields = response.split("|")
+            if match is None or len(fields) < 3:
+                print(f"isin {isin}: unexpected answer of the search, it is searched again on the next run")
+                return '||'
+            secid = match.group(1)
+            secid_type = fields[2].lower()
+            Isin2secid.store(isin, domain, secid, secid_type)
+            return secid + "|" + secid_type + "|" + domain
+        if resp.status_code == 200:
+            # only an empty answer of a successful search is a miss
+            Isin2secid.store(isin, domain, '', '')
+        return '||'
 
     @staticmethod
     def get_secid(isin, domain):
-        cached_secid = Isin2secid.mapping.get(isin, "-")
-        if cached_secid == "-" or len(cached_secid.split("|")) < 3:
-            url = f"https://www.morningstar.{domain}/en/util/SecuritySearch.ashx"
-            payload = {'q': isin, 'preferedList': '', 'source': 'nav', 'moduleId': 6, 'ifIncludeAds': False,
-                       'usrtType': 'v'}
-            headers = {'accept': '*/*', 'accept-encoding': 'gzip, deflate, br',
-                       'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36', }
-            resp = requests.post(url, data=payload, headers=headers)
-            response = resp.content.decode('utf-8')
-            if response:
-                secid = re.search('\{"i":"([^"]+)"', response).group(1)
-                secid_type = response.split("|")[2].lower()
-                secid_type_domain = secid + "|" + secid_type + "|" + domain
-                Isin2secid.mapping[isin] = secid_type_domain
-            else:
-                secid_type_domain = '||'
-        else:
-            secid_type_domain = Isin2secid.mapping[isin]
+        secid_type_domain = Isin2secid.lookup(isin, domain)
+        if secid_type_domain is None:
+            secid_type_domain = Isin2secid.search(isin, domain)
         return secid_type_domain.split("|")
+
+    @staticmethod
+    def get_secids(isins, domain, workers=WORKERS_DEFAULT):
+        """resolve many isins at once: the cached ones first, the others searched in parallel"""
+        resolved = dict()
+        missing = []
+        for isin in dict.fromkeys(isins):
+            secid_type_domain = Isin2secid.lookup(isin, domain)
+            if secid_type_domain is None:
+                missing.append(isin)
+            else:
+                resolved[isin] = secid_type_domain.split("|")
+        def search(isin):
+            # the search time and requests are the security's, as when it is resolved on its own
+            with RunReport.security(isin), RunReport.phase('secid'):
+                return Isin2secid.search(isin, domain)
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                for isin, secid_type_domain in zip(missing, executor.map(search, missing)):
+                    resolved[isin] = secid_type_domain.split("|")
+        return resolved
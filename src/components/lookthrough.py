@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from src.components.grouping import Grouping
+from src.components.holdings import SecurityHoldingReport
+from src.components.weights import UNSCALED_KINDS
+from src.utils.CONSTANTS import WORKERS_DEFAULT, LOOKTHROUGH_DEPTH
+from src.utils.run_report import RunReport
+from src.utils.taxonomies import taxonomies
+
+# kinds whose weights are shares of the whole fund rather than of the part not held through funds
+WHOLE_FUND_KINDS = frozenset(['Holding'])
+
+
+class LookThrough:
+    """expands the groupings of funds of funds with the groupings of the funds they hold
+
+    The groupings a fund reports are taken as covering the part of it that is not invested
+    in other funds; every held fund contributes its own groupings, expanded in turn, in
+    proportion to its weight. The asset types are reported on the whole portfolio and are
+    kept as they are.
+    The held funds are loaded level by level, each once per run, and go through the
+    classification store like any other fund, so that the next runs do not fetch them
+    again. A fund met again below itself is not expanded a second time, and the funds below
+    max_depth levels are taken with their own groupings only.
+    """
+
+    def __init__(self, domain, kinds=None, max_depth=LOOKTHROUGH_DEPTH, workers=WORKERS_DEFAULT):
+        self.domain = domain
+        self.kinds = [kind for kind in taxonomies if kinds is None or kind in kinds]
+        self.max_depth = max_depth
+        self.workers = workers
+        # secid -> report of a held fund
+        self.reports = dict()
+        # (secid, kind, depth) -> scaled grouping with the held funds expanded
+        self.exposures = dict()
+
+    def expand(self, reports):
+        """set the expanded groupings of the reports that hold funds"""
+        holders = [report for report in reports if report.funds]
+        if not holders:
+            return
+        with RunReport.phase('look-through'):
+            self.load_held_funds(holders)
+            for report in holders:
+                self.expand_report(report)
+        print(f"look-through: {len(holders)} funds of funds, {len(self.reports)} held funds")
+
+    def load_held_funds(self, holders):
+        level = holders
+        for depth in range(self.max_depth):
+            missing = dict()
+            for report in level:
+                for fund in report.funds or []:
+                    if fund.secid not in self.reports:
+                        missing.setdefault(fund.secid, fund)
+            if not missing:
+                return
+            funds = list(missing.values())
+            if self.workers <= 1 or len(funds) <= 1:
+                loaded = [self.load_fund(fund, depth + 1) for fund in funds]
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    loaded = list(executor.map(lambda fund: self.load_fund(fund, depth + 1), funds))
+            self.reports.update(zip(missing, loaded))
+            level = [report for report in loaded if report.funds]
+
+    def load_fund(self, fund, depth):
+        report = SecurityHoldingReport(self.domain)
+        # held funds come with a secid only, their name stands for the isin in the messages
+        report.isin = fund.name
+        # the holdings of the funds at the last level are not expanded
+        kinds = self.kinds if depth >= self.max_depth or 'Holding' in self.kinds else self.kinds + ['Holding']
+        with RunReport.security(fund.name):
+            report.load_secid(fund.secid, fund.secid_type, self.domain, kinds)
+        return report
+
+    def expand_report(self, report):
+        for kind in self.kinds:
+            if kind in UNSCALED_KINDS:
+                continue
+            factor = 1 if report.long_equity is None else report.long_equity
+            if factor <= 0:
+                print(f"  {report.isin} has no stocks of its own, its {kind} is not expanded")
+                continue
+            exposure, _ = self.get_exposure(report, kind, 0, frozenset())
+            # stored unscaled, like the groupings it replaces
+            report.expanded[kind] = Grouping(exposure, [weight / factor for weight in exposure.values()])
+
+    def get_exposure(self, report, kind, depth, path):
+        """scaled grouping of the kind of a fund with its held funds expanded, and whether a cycle was cut
+
+        The result is memoized unless a cycle was cut below the fund, since it then depends on
+        the path by which the fund was reached.
+        """
+        key = (report.secid, kind, depth)
+        if key in self.exposures:
+            return self.exposures[key], False
+        factor = 1 if report.long_equity is None else report.long_equity
+        exposure = {category: weight * factor for category, weight in report.grouping.get(kind, {}).items()}
+        cycle = False
+        held = []
+        if depth < self.max_depth:
+            path = path | {report.secid}
+            for fund in report.funds or []:
+                if fund.secid in path:
+                    print(f"  {fund.name} holds itself through {report.isin}, it is not expanded again")
+                    cycle = True
+                    continue
+                held_report = self.reports.get(fund.secid)
+                if held_report is not None and held_report.secid != '':
+                    held.append((fund, held_report))
+        if held:
+            if kind in WHOLE_FUND_KINDS:
+                # the held funds are listed among the holdings, they are replaced by their own holdings
+                for fund, _ in held:
+                    exposure.pop(fund.name, None)
+                    exposure.pop(fund.secid, None)
+            else:
+                invested = min(1.0, sum(fund.weight for fund, _ in held) / 100)
+                exposure = {category: weight * (1 - invested) for category, weight in exposure.items()}
+            for fund, held_report in held:
+                held_exposure, held_cycle = self.get_exposure(held_report, kind, depth + 1, path)
+                cycle = cycle or held_cycle
+                for category, held_weight in held_exposure.items():
+                    exposure[category] = exposure.get(category, 0) + held_weight * fund.weight / 100
+        if not cycle:
+            self.exposures[key] = exposure
+        return exposure, cycle
@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from src.components.transport import SessionPool
+
+
+class ReplayMissError(requests.ConnectionError):
+    """a request with no recording: failed like an unreachable host, the security is skipped and the run goes on"""
+
+
+def recording_key(method, url, params=None, data=None):
+    """identifies a request by method, url, query and form data; headers (and so the token) are left out"""
+    parts = [method.upper(), url]
+    for values in (params, data):
+        if isinstance(values, dict):
+            parts.append(urlencode(sorted((str(key), str(value)) for key, value in values.items())))
+        elif values is not None:
+            parts.append(str(values))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def build_response(method, url, status, headers, content):
+    response = requests.models.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = content
+    response.url = url
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers) or 'utf-8'
+    response.request = requests.Request(method, url).prepare()
+    return response
+
+
+class RecordingBackend:
+    """performs the requests with another backend and saves every response in a directory"""
+
+    def __init__(self, directory, backend=SessionPool.request):
+        self.directory = directory
+        self.backend = backend
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, method, url, **kwargs):
+        response = self.backend(method, url, **kwargs)
+        key = recording_key(method, url, kwargs.get('params'), kwargs.get('data'))
+        recording = {'method': method, 'url': url, 'params': kwargs.get('params'), 'data': kwargs.get('data'),
+                     'status': response.status_code, 'headers': dict(response.headers),
+                     'content': base64.b64encode(response.content).decode('ascii')}
+        # the headers describe the original, not the decoded, body
+        recording['headers'].pop('Content-Encoding', None)
+        recording['headers'].pop('Content-Length', None)
+        with open(os.path.join(self.directory, key + '.json'), 'w') as f:
+            json.dump(recording, f, indent=1, default=str)
+        return response
+
+
+class ReplayBackend:
+    """answers the requests with the responses saved by RecordingBackend, without network access
+
+    A GET without a recording for its exact query is answered with a recording of the same
+    url: the token page, for instance, is requested with the secid of whichever security
+    happens to need the token first.
+    """
+
+    def __init__(self, directory, latency=0):
+        self.directory = directory
+        self.latency = latency
+        self.recordings = dict()
+        self.urls = None
+        self.lock = threading.Lock()
+
+    def find_by_url(self, method, url):
+        with self.lock:
+            if self.urls is None:
+                self.urls = dict()
+                for name in sorted(os.listdir(self.directory)):
+                    if name.endswith('.json'):
+                        with open(os.path.join(self.directory, name)) as f:
+                            recording = json.load(f)
+                        self.urls.setdefault((recording['method'], recording['url']), recording)
+            return self.urls.get((method, url))
+
+    def load(self, key):
+        with self.lock:
+            if key not in self.recordings:
+                path = os.path.join(self.directory, key + '.json')
+                if os.path.exists(path):
+                    with open(path) as f:
+                        self.recordings[key] = json.load(f)
+                else:
+                    self.recordings[key] = None
+            return self.recordings[key]
+
+    def __call__(self, method, url, **kwargs):
+        recording = self.load(recording_key(method, url, kwargs.get('params'), kwargs.get('data')))
+        if recording is None and method.upper() == 'GET':
+            recording = self.find_by_url(method.upper(), url)
+        if recording is None:
+            raise ReplayMissError(f"no recording for {method} {url} in {self.directory}")
+        if self.latency:
+            time.sleep(self.latency)
+        return build_response(method, url, recording['status'], recording['headers'],
+                              base64.b64decode(recording['content']))
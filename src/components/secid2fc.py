@@ -0,0 +1,46 @@
+import json
+import os
+import re
+
+from src.components.transport import Transport
+from src.utils.lru import LRUCache
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36'
+
+
+class Secid2fc:
+    """the secid used to retrieve the portfolio data (var FC in the snapshot page) can differ from the secid"""
+    cache_size = None
+    mapping = LRUCache()
+
+    @staticmethod
+    def load_cache():
+        if os.path.exists("secid2fc.json"):
+            with open("secid2fc.json", "r") as f:
+                try:
+                    Secid2fc.mapping = LRUCache(Secid2fc.cache_size, json.load(f))
+                except json.JSONDecodeError:
+                    print("Invalid json file")
+
+    @staticmethod
+    def save_cache():
+        with open("secid2fc.json", "w") as f:
+            json.dump(Secid2fc.mapping, f, indent=1, sort_keys=True)
+
+    @staticmethod
+    def get_fc(secid, domain):
+        key = secid + "|" + domain
+        cached_fc = Secid2fc.mapping.get(key)
+        if cached_fc is None:
+            headers = {'user-agent': USER_AGENT}
+            url = f'https://www.morningstar.{domain}/{domain}/funds/snapshot/snapshot.aspx?id={secid}'
+            response = Transport.get(url, headers=headers)
+            if response.status_code != 200:
+                # an error or not a snapshot page, the secid is used for this run only
+                return secid
+            secid_regexp = r"var FC =  '(.*)';"
+            matches = re.findall(secid_regexp, response.text)
+            # a snapshot page without FC: the secid is used to retrieve the data
+            cached_fc = matches[0] if matches else secid
+            Secid2fc.mapping[key] = cached_fc
+        return cached_fc
@@ -0,0 +1,155 @@
+import json
+import os
+import signal
+import socketserver
+import sys
+import tempfile
+import threading
+import xml.parsers.expat
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.etree import ElementTree as ET
+
+from src.components.bearer_token import BearerToken
+from src.components.classification_store import ClassificationStore
+from src.components.classifier import PortfolioPerformanceFile
+from src.components.extractors import select_taxonomies
+from src.components.file_format import ZIP_SIGNATURE, UnsupportedFormatError
+from src.components.isin2secid import Isin2secid
+from src.components.secid2fc import Secid2fc
+from src.components.streaming import StreamingPortfolioPerformanceFile
+from src.utils.CONSTANTS import DOMAIN_DEFAULT, WORKERS_DEFAULT, SERVER_HOST, SERVER_PORT
+from src.utils.taxonomies import taxonomies
+
+OUTPUTS = ('xml', 'taxonomies')
+
+
+class ClassifierService:
+    """classification jobs run by a long-lived process
+
+    The secid map, the tokens, the compiled taxonomies and the fetched groupings are class
+    level state of their components, so every job starts with what the previous ones loaded.
+    """
+
+    def __init__(self, workers=WORKERS_DEFAULT, look_through=0):
+        self.workers = workers
+        self.look_through = look_through
+        self.jobs = 0
+        self.lock = threading.Lock()
+
+    def classify(self, content, domain=DOMAIN_DEFAULT, output='xml', stream=False, kinds=tuple(taxonomies)):
+        """classify a portfolio performance file given as bytes, plain or zipped xml
+
+        Returns the classified file in the format it was given, or with output='taxonomies'
+        only a <taxonomies> element holding the taxonomies that were added or updated.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, 'input')
+            with open(input_path, 'wb') as f:
+                f.write(content)
+            if stream:
+                pp_file = StreamingPortfolioPerformanceFile(input_path, domain, self.workers, kinds, self.look_through)
+            else:
+                pp_file = PortfolioPerformanceFile(input_path, domain, self.workers, kinds, self.look_through)
+            pp_file.get_securities()
+            classified = [pp_file.add_taxonomy(kind) for kind in kinds]
+            with self.lock:
+                self.jobs += 1
+            if output == 'taxonomies':
+                fragment = ET.Element('taxonomies')
+                fragment.extend(classified)
+                return ET.tostring(fragment, encoding='utf-8')
+            output_path = os.path.join(directory, 'output')
+            pp_file.write_xml(output_path)
+            with open(output_path, 'rb') as f:
+                return f.read()
+
+    def status(self):
+        return {'jobs': self.jobs,
+                'secids': len(Isin2secid.mapping),
+                'fcs': len(Secid2fc.mapping),
+                'tokens': len(BearerToken.tokens),
+                'groupings': len(ClassificationStore.memory)}
+
+
+class ClassifierRequestHandler(BaseHTTPRequestHandler):
+    """local api of the classifier server
+
+    POST /classify with the portfolio xml (or zipped xml) as body returns the classified file. Query
+    parameters: domain (default de), output=taxonomies to only get the classified
+    taxonomies, taxonomies=Region,Sector to only add some of them, stream=1 to process
+    the file with the streaming reader.
+    GET /status returns the number of jobs done and the sizes of the in-memory caches.
+    """
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/status':
+            self.send_error(404)
+            return
+        self.send_body(200, 'application/json', json.dumps(self.server.service.status()).encode('utf-8'))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/classify':
+            self.send_error(404)
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        output = query.get('output', 'xml')
+        if output not in OUTPUTS:
+            self.send_body(400, 'text/plain', f"output must be one of {', '.join(OUTPUTS)}".encode('utf-8'))
+            return
+        try:
+            kinds = select_taxonomies(query['taxonomies']) if 'taxonomies' in query else list(taxonomies)
+        except ValueError as e:
+            self.send_body(400, 'text/plain', str(e).encode('utf-8'))
+            return
+        content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            result = self.server.service.classify(content, query.get('domain', DOMAIN_DEFAULT), output,
+                                                  query.get('stream') == '1', kinds)
+        except (ET.ParseError, xml.parsers.expat.ExpatError, zipfile.BadZipFile, UnsupportedFormatError) as e:
+            self.send_body(400, 'text/plain', f"invalid portfolio performance file: {e}".encode('utf-8'))
+            return
+        except Exception as e:
+            self.log_error("classification failed: %r", e)
+            self.send_body(500, 'text/plain', f"classification failed: {e!r}".encode('utf-8'))
+            return
+        zipped = output == 'xml' and result.startswith(ZIP_SIGNATURE)
+        self.send_body(200, 'application/zip' if zipped else 'application/xml', result)
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # clients of a unix socket have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(service, host=SERVER_HOST, port=SERVER_PORT, socket_path=None):
+    """answer classification requests on a local port, or on a unix socket, until interrupted"""
+    if socket_path is not None:
+        server = ThreadingUnixHTTPServer(socket_path, ClassifierRequestHandler)
+        print(f"listening on {socket_path}")
+    else:
+        server = ThreadingHTTPServer((host, port), ClassifierRequestHandler)
+        print(f"listening on http://{host}:{port}")
+    server.service = service
+    # stopping the daemon saves its caches like an interrupt does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,246 @@
+import shutil
+import xml.parsers.expat
+from xml.etree import ElementTree as ET
+
+from src.components.classifier import PortfolioPerformanceFile
+from src.components.discovery import SecurityReferences
+from src.components.file_format import detect_format, open_portfolio_file, create_portfolio_file, \
+    get_content_size
+from src.utils.CONSTANTS import WORKERS_DEFAULT
+
+SECURITY_FIELDS = {'uuid', 'name', 'isin', 'secid'}
+TRANSACTION_FIELDS = {'shares', 'type'}
+CHUNK_SIZE = 1 << 20
+
+
+class PortfolioScanner:
+    """single streaming pass over a portfolio performance file
+
+    Collects the identifying fields and the latest price of the securities, every security
+    reference (resolved against the path of the element holding it, with the shares of the
+    portfolio transactions) and the <taxonomies> section with the byte offsets of it and of
+    each of its taxonomies; everything else (price history, settings...) is skipped without
+    being kept in memory.
+    """
+
+    def __init__(self):
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.data
+        self.stack = []
+        # (name, index among the siblings of that name) of the open elements, and their child counts
+        self.path = []
+        self.child_counts = [dict()]
+        self.securities = []
+        self.references = SecurityReferences()
+        self.security = None
+        self.price = None
+        self.open_transactions = []
+        self.field = None
+        self.field_depth = None
+        self.text = []
+        self.builder = None
+        self.taxonomies = None
+        self.taxonomies_start = None
+        self.taxonomies_end = None
+        self.taxonomy_offsets = []
+        self.root_end = None
+
+    def parse(self, f):
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            self.parser.Parse(chunk, not chunk)
+            if not chunk:
+                break
+        return self
+
+    def start(self, name, attrs):
+        depth = len(self.stack)
+        self.stack.append(name)
+        counts = self.child_counts[-1]
+        if counts is None:
+            # nothing below a security references one, its price history is not counted
+            self.path.append(None)
+            self.child_counts.append(None)
+        else:
+            index = counts[name] = counts.get(name, 0) + 1
+            self.path.append((name, index))
+            self.child_counts.append(None if depth == 2 and self.stack[1] == 'securities' else dict())
+        if self.builder is not None:
+            element = self.builder.start(name, attrs)
+            if depth == 2:
+                self.taxonomy_offsets.append([element, self.parser.CurrentByteIndex, None])
+        elif depth == 2 and name == 'security' and self.stack[1] == 'securities':
+            self.security = ET.Element('security')
+            if 'id' in attrs:
+                self.references.ids[attrs['id']] = len(self.securities)
+        elif depth == 3 and self.security is not None and name in SECURITY_FIELDS:
+            self.start_field(ET.SubElement(self.security, name), depth)
+        elif depth == 3 and self.security is not None and name == 'latest':
+            ET.SubElement(self.security, name, attrs)
+        elif depth == 4 and self.security is not None and name == 'price' and self.stack[3] == 'prices':
+            # only the last price of the history is kept
+            self.price = attrs
+        elif name == 'portfolio-transaction' and 'reference' not in attrs:
+            # the shares and type may follow the security, it is added at the end of the transaction
+            self.open_transactions.append((ET.Element(name), depth, []))
+        elif self.open_transactions and self.open_transactions[-1][1] == depth - 1 and name in TRANSACTION_FIELDS:
+            self.start_field(ET.SubElement(self.open_transactions[-1][0], name), depth)
+        elif name == 'security' and 'reference' in attrs:
+            if self.open_transactions and self.open_transactions[-1][1] == depth - 1:
+                self.open_transactions[-1][2].append((tuple(self.path), attrs['reference']))
+            else:
+                self.references.add_reference(tuple(self.path), attrs['reference'], self.stack[-2], lambda field: None)
+        elif depth == 1 and name == 'taxonomies':
+            self.taxonomies_start = self.parser.CurrentByteIndex
+            self.builder = ET.TreeBuilder()
+            self.builder.start(name, attrs)
+
+    def end(self, name):
+        self.stack.pop()
+        self.path.pop()
+        self.child_counts.pop()
+        depth = len(self.stack)
+        if self.builder is not None:
+            self.builder.end(name)
+            if depth == 2:
+                # start of the end tag, or the end of an empty element tag
+                self.taxonomy_offsets[-1][2] = self.parser.CurrentByteIndex
+            elif depth == 1:
+                self.taxonomies = self.builder.close()
+                self.builder = None
+                # start of </taxonomies>, or the end of <taxonomies/>
+                self.taxonomies_end = self.parser.CurrentByteIndex
+        elif self.field is not None and depth == self.field_depth:
+            self.field.text = ''.join(self.text)
+            self.field = None
+        elif self.security is not None and depth == 2:
+            if self.price is not None:
+                ET.SubElement(ET.SubElement(self.security, 'prices'), 'price', self.price)
+                self.price = None
+            self.securities.append(self.security)
+            self.security = None
+        elif self.open_transactions and self.open_transactions[-1][1] == depth:
+            transaction, _, references = self.open_transactions.pop()
+            for path, reference in references:
+                self.references.add_reference(path, reference, transaction.tag, transaction.findtext)
+        elif depth == 0:
+            self.root_end = self.parser.CurrentByteIndex
+
+    def start_field(self, field, depth):
+        self.field = field
+        self.field_depth = depth
+        self.text = []
+
+    def data(self, text):
+        if self.builder is not None:
+            self.builder.data(text)
+        elif self.field is not None:
+            self.text.append(text)
+
+
+class StreamingPortfolioPerformanceFile(PortfolioPerformanceFile):
+    """portfolio performance file that is never loaded as a whole
+
+    write_xml copies the original bytes to the output file, replaces the taxonomies
+    updated by add_taxonomy and inserts the new ones at the end of the <taxonomies> section.
+    A zipped file is decompressed while it is scanned and copied, and written zipped.
+    """
+
+    def __init__(self, filepath, domain, workers=WORKERS_DEFAULT, kinds=None, look_through=0):
+        self.filepath = filepath
+        self.file_format = detect_format(filepath)
+        self.pp_tree = None
+        self.pp = None
+        self.securities = None
+        self.domain = domain
+        self.workers = workers
+        self.kinds = kinds
+        self.look_through = look_through
+        self.weight_matrices = dict()
+        self.new_taxonomies = []
+        self.replaced_taxonomies = []
+        with open_portfolio_file(filepath, self.file_format) as f:
+            self.scan = PortfolioScanner().parse(f)
+        self.index_securities(self.scan.securities)
+
+    def check_security_index(self):
+        # the securities of the original file cannot change
+        pass
+
+    def get_security_references(self):
+        return self.scan.references
+
+    def get_taxonomies(self):
+        return [] if self.scan.taxonomies is None else self.scan.taxonomies
+
+    def append_taxonomy(self, taxonomy):
+        self.new_taxonomies.append(taxonomy)
+
+    def replace_taxonomy(self, taxonomy):
+        if not any(replaced is taxonomy for replaced in self.replaced_taxonomies):
+            self.replaced_taxonomies.append(taxonomy)
+
+    def get_edits(self, source):
+        """(start, end, bytes) replacements of the original file, in file order"""
+        edits = []
+        for element, start, end in self.scan.taxonomy_offsets:
+            if not any(replaced is element for replaced in self.replaced_taxonomies):
+                continue
+            source.seek(end)
+            head = source.read(2)
+            if head == b'</':
+                # skip to the end of the end tag
+                while not head.endswith(b'>'):
+                    head = source.read(1)
+                    if not head:
+                        break
+                end = source.tell()
+            tail, element.tail = element.tail, None
+            edits.append((start, end, ET.tostring(element, encoding='unicode').encode('utf-8')))
+            element.tail = tail
+
+        if not self.new_taxonomies:
+            return edits
+        inserted = ''.join(ET.tostring(taxonomy, encoding='unicode') for taxonomy in self.new_taxonomies)
+        inserted = inserted.encode('utf-8')
+        if self.scan.taxonomies_start is None:
+            edits.append((self.scan.root_end, self.scan.root_end, b'<taxonomies>' + inserted + b'</taxonomies>'))
+            return edits
+        position = self.scan.taxonomies_end
+        source.seek(position - 2)
+        if len(self.scan.taxonomies) == 0 and source.read(2) == b'/>':
+            # <taxonomies/> is replaced by a section holding the new taxonomies
+            edits.append((self.scan.taxonomies_start, position, b'<taxonomies>' + inserted + b'</taxonomies>'))
+        else:
+            edits.append((position, position, inserted))
+        return edits
+
+    def write_xml(self, output_file):
+        size_hint = get_content_size(self.filepath, self.file_format)
+        with open_portfolio_file(self.filepath, self.file_format) as source, \
+                create_portfolio_file(output_file, self.file_format, size_hint) as target:
+            edits = self.get_edits(source)
+            source.seek(0)
+            position = 0
+            for start, end, replacement in edits:
+                copy_bytes(source, target, start - position)
+                target.write(replacement)
+                source.seek(end)
+                position = end
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+    def dump_xml(self):
+        for taxonomy in self.replaced_taxonomies + self.new_taxonomies:
+            print(ET.tostring(taxonomy, encoding="unicode"))
+
+
+def copy_bytes(source, target, length):
+    while length > 0:
+        chunk = source.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            break
+        target.write(chunk)
+        length -= len(chunk)
@@ -0,0 +1,274 @@
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.utils.CONSTANTS import HOST_CONCURRENCY, HOST_RATE_LIMIT, HTTP_TIMEOUT, HTTP_RETRIES, BACKOFF_BASE, \
+    BACKOFF_MAX, BREAKER_THRESHOLD, BREAKER_COOLDOWN, HTTP_CACHE_PATH, HTTP_CACHE_EXPIRE
+from src.utils.run_report import RunReport
+
+try:
+    import brotli  # noqa: F401 - lets urllib3 decode br responses
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# path segments holding an id (secid, token...) are left out of the endpoint of a url
+ID_SEGMENT_REGEX = re.compile(r"[^/]*\d[^/]*")
+
+
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+class HostLimiter:
+    """caps the number of simultaneous requests and the request rate for one host"""
+
+    def __init__(self, concurrency, rate_limit):
+        self.semaphore = threading.BoundedSemaphore(max(1, concurrency))
+        self.interval = 1 / rate_limit if rate_limit else 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        if self.interval:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.next_slot - now
+                self.next_slot = max(now, self.next_slot) + self.interval
+            if wait > 0:
+                time.sleep(wait)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.semaphore.release()
+
+
+class CircuitBreaker:
+    """stops calling an endpoint that keeps failing
+
+    After threshold consecutive failures the circuit opens and the requests to the endpoint
+    fail at once for cooldown seconds. Then a single trial request is let through, which
+    closes the circuit if it succeeds and opens it again if it fails.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def check(self, endpoint):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpenError(f"too many failures of {endpoint}, not called for now")
+            self.trial = True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.threshold and self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class SessionPool:
+    """keep-alive session per host
+
+    The sessions are created on first use, after requests_cache.install_cache, so that they
+    are cached sessions when the cache is installed.
+    """
+    sessions = dict()
+    lock = threading.Lock()
+
+    @staticmethod
+    def get_session(url):
+        host = urlsplit(url).netloc
+        with SessionPool.lock:
+            session = SessionPool.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, Transport.concurrency))
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+                SessionPool.sessions[host] = session
+        return session
+
+    @staticmethod
+    def request(method, url, **kwargs):
+        return SessionPool.get_session(url).request(method, url, **kwargs)
+
+    @staticmethod
+    def close():
+        with SessionPool.lock:
+            for session in SessionPool.sessions.values():
+                session.close()
+            SessionPool.sessions = dict()
+
+
+class Transport:
+    """single entry point for every http request made to morningstar
+
+    Requests get a timeout and are retried with a jittered exponential backoff (at least
+    the Retry-After of the response) when they fail or get a 429 or 5xx; every endpoint
+    has its own circuit breaker.
+    """
+    concurrency = HOST_CONCURRENCY
+    rate_limit = HOST_RATE_LIMIT
+    timeout = HTTP_TIMEOUT
+    retries = HTTP_RETRIES
+    limiters = dict()
+    breakers = dict()
+    lock = threading.Lock()
+    # callable(method, url, **kwargs) doing the actual request, e.g. a recording or replaying backend
+    backend = SessionPool.request
+    requests_made = 0
+
+    @staticmethod
+    def configure(concurrency=None, rate_limit=None, backend=None, timeout=None, retries=None):
+        with Transport.lock:
+            if concurrency is not None:
+                Transport.concurrency = concurrency
+            if rate_limit is not None:
+                Transport.rate_limit = rate_limit
+            if backend is not None:
+                Transport.backend = backend
+            if timeout is not None:
+                Transport.timeout = timeout
+            if retries is not None:
+                Transport.retries = retries
+            Transport.limiters = dict()
+            Transport.breakers = dict()
+
+    @staticmethod
+    def get_limiter(url):
+        host = urlsplit(url).netloc
+        with Transport.lock:
+            limiter = Transport.limiters.get(host)
+            if limiter is None:
+                limiter = HostLimiter(Transport.concurrency, Transport.rate_limit)
+                Transport.limiters[host] = limiter
+        return limiter
+
+    @staticmethod
+    def get_breaker(url):
+        parts = urlsplit(url)
+        endpoint = parts.netloc + ID_SEGMENT_REGEX.sub('{id}', parts.path)
+        with Transport.lock:
+            breaker = Transport.breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+                Transport.breakers[endpoint] = breaker
+        return endpoint, breaker
+
+    @staticmethod
+    def get_backoff(attempt, response=None):
+        """seconds to wait before the retry following the attempt"""
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        retry_after = get_retry_after(response)
+        if retry_after is not None:
+            delay = max(delay, min(BACKOFF_MAX, retry_after))
+        return delay
+
+    @staticmethod
+    def request(method, url, **kwargs):
+        kwargs.setdefault('timeout', Transport.timeout)
+        endpoint, breaker = Transport.get_breaker(url)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            response = None
+            error = None
+            try:
+                breaker.check(endpoint)
+                with Transport.get_limiter(url):
+                    with Transport.lock:
+                        Transport.requests_made += 1
+                    response = Transport.backend(method, url, **kwargs)
+            except CircuitOpenError as circuit_open:
+                RunReport.record_request(method, url, time.perf_counter() - start, error=circuit_open,
+                                         retries=attempt)
+                raise
+            except requests.RequestException as request_error:
+                error = request_error
+            except Exception as unexpected:
+                breaker.failure()
+                RunReport.record_request(method, url, time.perf_counter() - start, error=unexpected, retries=attempt)
+                raise
+
+            if error is None and response.status_code not in RETRY_STATUSES:
+                breaker.success()
+                RunReport.record_request(method, url, time.perf_counter() - start, response=response,
+                                         retries=attempt)
+                return response
+            breaker.failure()
+            if attempt >= Transport.retries:
+                RunReport.record_request(method, url, time.perf_counter() - start, response=response, error=error,
+                                         retries=attempt)
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(Transport.get_backoff(attempt, response))
+            attempt += 1
+
+    @staticmethod
+    def get(url, **kwargs):
+        return Transport.request('GET', url, **kwargs)
+
+    @staticmethod
+    def post(url, **kwargs):
+        return Transport.request('POST', url, **kwargs)
+
+
+def install_http_cache():
+    """cache the downloaded files for a day
+
+    The expired files are not served, but they are only removed by prune_http_cache
+    (app.py maintenance): scanning the cache on every start is too slow for large caches.
+    """
+    import requests_cache
+    requests_cache.install_cache(HTTP_CACHE_PATH, expire_after=HTTP_CACHE_EXPIRE)
+    # sessions opened before have to be cached sessions too
+    SessionPool.close()
+
+
+def prune_http_cache():
+    """remove the expired files from the http cache and compact it, return the number of files left"""
+    import requests_cache
+    install_http_cache()
+    cache = requests_cache.get_cache()
+    cache.delete(expired=True, vacuum=True)
+    return len(cache.responses)
+
+
+def get_retry_after(response):
+    """seconds asked by the Retry-After header of a response, None without one"""
+    if response is None or not response.headers.get('Retry-After'):
+        return None
+    value = response.headers['Retry-After']
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,79 @@
+import numpy as np
+
+UNSCALED_KINDS = frozenset(['Asset-Type'])
+
+
+class WeightMatrix:
+    """securities x categories weights of a taxonomy, in percent, kept sparse
+
+    The categories are the vocabulary shared by all the securities of the taxonomy, in the
+    order they are first met. Only the weights the securities reported are stored, as
+    (row, column, value) triplets sorted security after security, so that a reported 0% is
+    still assigned and a vocabulary as large as the holdings takes no more room than them.
+    """
+
+    def __init__(self, kind, categories, rows, columns, values):
+        self.kind = kind
+        self.categories = categories
+        self.rows = rows
+        self.columns = columns
+        self.values = values
+
+    @staticmethod
+    def from_securities(kind, securities):
+        """matrix of the groupings of the securities, scaled by their long equity share
+
+        Every grouping but the asset types covers the stock part of a fund only and is
+        scaled by the share of long stocks in it.
+        """
+        index = dict()
+        rows = []
+        columns = []
+        values = []
+        factors = np.ones(len(securities))
+        for row, security in enumerate(securities):
+            report = security.holdings
+            for category, weight in report.get_grouping(kind).items():
+                column = index.setdefault(category, len(index))
+                rows.append(row)
+                columns.append(column)
+                values.append(weight)
+            if report.long_equity is not None:
+                factors[row] = report.long_equity
+
+        rows = np.array(rows, dtype=np.intp)
+        columns = np.array(columns, dtype=np.intp)
+        values = np.array(values, dtype=float)
+        order = np.lexsort((columns, rows))
+        rows, columns, values = rows[order], columns[order], values[order]
+        if kind not in UNSCALED_KINDS:
+            values *= factors[rows]
+        return WeightMatrix(kind, list(index), rows, columns, values)
+
+    def basis_points(self):
+        """weight of every assignment as portfolio performance stores it, 10000 being 100%"""
+        return np.rint(self.values * 100).astype(np.int64)
+
+    def ranks(self):
+        """rank of every assignment, numbered security after security"""
+        return np.arange(1, len(self.values) + 1)
+
+    def assignments(self):
+        """(category, rows, basis points, ranks) of every category, its securities in order"""
+        order = np.argsort(self.columns, kind='stable')
+        rows = self.rows[order].tolist()
+        weights = self.basis_points()[order].tolist()
+        ranks = self.ranks()[order].tolist()
+        bounds = np.cumsum(np.bincount(self.columns, minlength=len(self.categories))).tolist()
+        start = 0
+        for category, end in zip(self.categories, bounds):
+            yield category, rows[start:end], weights[start:end], ranks[start:end]
+            start = end
+
+    def exposure(self, values):
+        """look-through weight of every category in percent of the total value of the securities"""
+        total = values.sum()
+        if total <= 0:
+            return dict.fromkeys(self.categories, 0.0)
+        exposure = np.bincount(self.columns, weights=self.values * values[self.rows], minlength=len(self.categories))
+        return dict(zip(self.categories, (exposure / total).tolist()))
@@ -0,0 +1,106 @@
+from html.parser import HTMLParser
+from typing import NamedTuple
+
+NON_CATEGORIES = frozenset(['Defensive', 'Cyclical', 'Sensitive', 'Greater Europe', 'Americas', 'Greater Asia', ])
+
+
+class XrayCell(NamedTuple):
+    tag: str
+    text: str
+
+
+class XrayRow(NamedTuple):
+    cells: list
+    text: str
+
+    def tds(self):
+        return [cell for cell in self.cells if cell.tag == 'td']
+
+    def header(self):
+        """first th of the row, or its first td if it has no th"""
+        for tag in ('th', 'td'):
+            for cell in self.cells:
+                if cell.tag == tag:
+                    return cell
+        return None
+
+
+class XrayTableParser(HTMLParser):
+    """collects the rows of every table.ms_data of the x-ray page in a single pass
+
+    A row belongs to every ms_data table it is nested in and a cell to every row it is
+    nested in, the same as with a css selection on the parsed document.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = []
+        self.open_tables = []
+        self.open_rows = []
+        self.open_cells = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            classes = (dict(attrs).get('class') or '').split()
+            rows = [] if 'ms_data' in classes else None
+            if rows is not None:
+                self.tables.append(rows)
+            self.open_tables.append((rows, len(self.open_rows), len(self.open_cells)))
+        elif tag == 'tr' and any(rows is not None for rows, _, _ in self.open_tables):
+            row = ([], [])
+            for rows, _, _ in self.open_tables:
+                if rows is not None:
+                    rows.append(row)
+            self.open_rows.append(row)
+        elif tag in ('td', 'th') and self.open_rows:
+            cell = (tag, [])
+            for cells, _ in self.open_rows:
+                cells.append(cell)
+            self.open_cells.append(cell)
+
+    def handle_endtag(self, tag):
+        if tag == 'table' and self.open_tables:
+            _, row_depth, cell_depth = self.open_tables.pop()
+            # close what the table left open
+            del self.open_rows[row_depth:]
+            del self.open_cells[cell_depth:]
+        elif tag == 'tr' and self.open_rows:
+            self.open_rows.pop()
+        elif tag in ('td', 'th') and self.open_cells:
+            self.open_cells.pop()
+
+    def handle_data(self, data):
+        for _, texts in self.open_rows:
+            texts.append(data)
+        for _, texts in self.open_cells:
+            texts.append(data)
+
+
+def parse_xray_tables(html):
+    """return the ms_data tables of an x-ray page as lists of XrayRow"""
+    parser = XrayTableParser()
+    parser.feed(html)
+    parser.close()
+    return [[XrayRow([XrayCell(tag, ''.join(texts)) for tag, texts in cells], ''.join(texts)) for cells, texts in rows]
+            for rows in parser.tables]
+
+
+def extract_xray_table(rows, column):
+    """categories and percentages of an x-ray table, skipping its header row"""
+    categories = []
+    percentages = []
+    for row in rows[1:]:
+        header = row.header()
+        if row.text != '' and header is not None and header.text not in NON_CATEGORIES:
+            categories.append(header.text)
+            tds = row.tds()
+            if len(tds) > column:
+                percentages.append(float('0' + tds[column].text.replace(",", ".").replace("-", "")))
+            else:
+                percentages.append(0.0)
+    return categories, percentages
+
+
+def xray_long_equity(rows):
+    """share of long stocks in the asset allocation table"""
+    return float(rows[1].tds()[0].text.replace(",", ".")) / 100
@@ -13,3 +13,31 @@ COLORS = ["#EFDECD", "#CD9575", "#FDD9B5", "#78DBE2", "#87A96B", "#FFA474", "#FA
           "#FD5E53", "#FAA76C", "#18A7B5", "#EBC7DF", "#FC89AC", "#DBD7D2", "#17806D", "#DEAA88", "#77DDE7", "#FFFF66",
           "#926EAE", "#324AB2", "#F75394", "#FFA089", "#8F509D", "#FFFFFF", "#A2ADD0", "#FF43A4", "#FC6C85", "#CDA4DE",
           "#FCE883", "#C5E384", "#FFAE42"]
+WORKERS_DEFAULT = 8  # securities fetched in parallel
+HOST_CONCURRENCY = 4  # simultaneous requests per host
+HOST_RATE_LIMIT = 10  # requests per second per host, 0 for no limit
+TOKEN_TTL = 60 * 30  # seconds a bearer token is used when its expiry cannot be read from it
+TOKEN_EXPIRY_MARGIN = 60  # seconds before expiry at which a token is renewed
+TOKEN_MIN_AGE = 60  # a 401 with a token younger than this is not blamed on the token
+STORE_PATH = 'classifications.sqlite'  # classifications kept between runs
+STORE_MAX_AGE = 60 * 60 * 24  # seconds a stored classification without portfolio date is used before it is fetched again
+SECID_STORE_PATH = 'isin2secid.sqlite'  # isin -> secid mapping shared by all runs
+SECID_NEGATIVE_TTL = 60 * 60 * 24 * 7  # seconds an isin not found in a domain is not searched again
+SERVER_HOST = '127.0.0.1'  # the server only listens locally
+SERVER_PORT = 8765
+SERVER_CACHE_SIZE = 100000  # entries of each in-memory cache of the server
+HTTP_TIMEOUT = (10, 30)  # seconds to connect and to wait for data from morningstar
+HTTP_RETRIES = 3  # retries of a request that failed or got a 429 or 5xx
+BACKOFF_BASE = 0.5  # seconds before the first retry, doubled on each following one
+BACKOFF_MAX = 30  # longest wait before a retry, Retry-After included
+BREAKER_THRESHOLD = 5  # consecutive failures of an endpoint after which it is not called for a while
+BREAKER_COOLDOWN = 30  # seconds an endpoint is not called after too many failures
+HTTP_CACHE_PATH = 'http_cache'  # requests_cache database of the downloaded files
+HTTP_CACHE_EXPIRE = 60 * 60 * 24  # seconds a downloaded file is reused
+STORE_RETENTION = 60 * 60 * 24 * 30  # seconds an expired classification is kept before maintenance removes it
+LOOKTHROUGH_DEPTH = 3  # levels of funds held by funds expanded by --look-through
+STORE_STALE_WINDOW = 60 * 60 * 24 * 7  # seconds past its expiry a classification is used while being fetched again
+PORTFOLIO_INTERVAL = 60 * 60 * 24 * 31  # seconds between two portfolios of a fund
+PORTFOLIO_LAG = 60 * 60 * 24 * 15  # seconds after its date a portfolio is usually published
+PORTFOLIO_RECHECK = 60 * 60 * 24 * 7  # longest wait before an overdue portfolio is checked again
+REVALIDATION_WORKERS = 2  # stale classifications fetched again in the background at the same time
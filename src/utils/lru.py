@@ -0,0 +1,42 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(OrderedDict):
+    """dict keeping at most maxsize entries, the least recently used ones are evicted first
+
+    maxsize None means no limit. Every access is done under a lock, so that the worker
+    threads of a long-running server can share it.
+    """
+
+    def __init__(self, maxsize=None, *args, **kwargs):
+        self.maxsize = maxsize
+        self.lock = threading.RLock()
+        super().__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = super().__getitem__(key)
+            self.move_to_end(key)
+            return value
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self:
+                return default
+            return self[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self) > self.maxsize:
+                    self.popitem(last=False)
+
+    def setdefault(self, key, default=None):
+        with self.lock:
+            if key in self:
+                return self[key]
+            self[key] = default
+            return default
@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class RunReport:
+    """timings and request statistics of a run, written as json at the end of it
+
+    Phases and requests made while a security is being processed (see RunReport.security)
+    are attributed to that security, the other ones to the run.
+    """
+    enabled = False
+    lock = threading.Lock()
+    current = threading.local()
+    started = None
+    phases = defaultdict(float)
+    securities = dict()
+    requests = []
+
+    @staticmethod
+    def start():
+        with RunReport.lock:
+            RunReport.enabled = True
+            RunReport.started = time.time()
+            RunReport.phases = defaultdict(float)
+            RunReport.securities = dict()
+            RunReport.requests = []
+
+    @staticmethod
+    def get_security_entry(isin):
+        entry = RunReport.securities.get(isin)
+        if entry is None:
+            entry = {'phases': defaultdict(float), 'requests': []}
+            RunReport.securities[isin] = entry
+        return entry
+
+    @staticmethod
+    @contextmanager
+    def security(isin):
+        """attribute the phases and requests of the current thread to the security"""
+        previous = getattr(RunReport.current, 'isin', None)
+        RunReport.current.isin = isin
+        try:
+            yield
+        finally:
+            RunReport.current.isin = previous
+
+    @staticmethod
+    @contextmanager
+    def phase(name):
+        if not RunReport.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            isin = getattr(RunReport.current, 'isin', None)
+            with RunReport.lock:
+                if isin is None:
+                    RunReport.phases[name] += seconds
+                else:
+                    RunReport.get_security_entry(isin)['phases'][name] += seconds
+
+    @staticmethod
+    def record_request(method, url, seconds, response=None, error=None, retries=0):
+        if not RunReport.enabled:
+            return
+        entry = {'method': method, 'url': url, 'seconds': round(seconds, 4), 'retries': retries}
+        if response is not None:
+            entry['status'] = response.status_code
+            entry['bytes'] = len(response.content)
+            # set by requests_cache, absent when the cache is not installed
+            entry['from_cache'] = getattr(response, 'from_cache', None)
+        if error is not None:
+            entry['error'] = repr(error)
+        isin = getattr(RunReport.current, 'isin', None)
+        with RunReport.lock:
+            if isin is None:
+                RunReport.requests.append(entry)
+            else:
+                RunReport.get_security_entry(isin)['requests'].append(entry)
+
+    @staticmethod
+    def summarize(requests):
+        summary = {'requests': len(requests), 'bytes': 0, 'retries': 0, 'seconds': 0.0,
+                   'cache_hits': 0, 'cache_misses': 0, 'status': defaultdict(int)}
+        for request in requests:
+            summary['bytes'] += request.get('bytes', 0)
+            summary['retries'] += request['retries']
+            summary['seconds'] += request['seconds']
+            summary['status'][str(request.get('status', 'error'))] += 1
+            if request.get('from_cache') is True:
+                summary['cache_hits'] += 1
+            elif request.get('from_cache') is False:
+                summary['cache_misses'] += 1
+        summary['seconds'] = round(summary['seconds'], 4)
+        return summary
+
+    @staticmethod
+    def to_dict():
+        with RunReport.lock:
+            securities = dict()
+            all_requests = list(RunReport.requests)
+            for isin, entry in RunReport.securities.items():
+                all_requests.extend(entry['requests'])
+                securities[isin] = {'phases': {name: round(seconds, 4) for name, seconds in entry['phases'].items()},
+                                    'summary': RunReport.summarize(entry['requests']),
+                                    'requests': entry['requests']}
+            return {'started': RunReport.started,
+                    'seconds': round(time.time() - RunReport.started, 4) if RunReport.started else None,
+                    'phases': {name: round(seconds, 4) for name, seconds in RunReport.phases.items()},
+                    'summary': RunReport.summarize(all_requests),
+                    'securities': securities,
+                    'requests': RunReport.requests}
+
+    @staticmethod
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(RunReport.to_dict(), f, indent=1)
@@ -0,0 +1,162 @@
+"""the concurrent fetch gives the same taxonomies as the serial one, within the per-host caps
+
+python -m unittest discover -s test   (or python -m pytest test), from the install directory
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+from collections import defaultdict
+
+from benchmarks.synthetic import SyntheticBackend, write_pp_file
+from src.components.bearer_token import BearerToken
+from src.components.classification_store import ClassificationStore
+from src.components.classifier import PortfolioPerformanceFile
+from src.components.isin2secid import Isin2secid
+from src.components.replay import build_response
+from src.components.secid2fc import Secid2fc
+from src.components.transport import Transport, HostLimiter
+from src.utils.lru import LRUCache
+from src.utils.taxonomies import taxonomies
+
+SECURITIES = 24
+WORKERS = 8
+HOST_CONCURRENCY = 3
+
+
+def scale_numbers(value, factor):
+    if isinstance(value, dict):
+        return {key: scale_numbers(item, factor) for key, item in value.items()}
+    if isinstance(value, list):
+        return [scale_numbers(item, factor) for item in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value * factor
+    return value
+
+
+class StubBackend(SyntheticBackend):
+    """SyntheticBackend whose SAL answers differ from one fund to the other
+
+    A fund mixed up with another one by the concurrent fetch would get wrong weights. It
+    also records the most requests that were in flight at once for each host.
+    """
+
+    def __init__(self):
+        super().__init__(latency=0.005, xray_every=5)
+        self.in_flight = defaultdict(int)
+        self.max_in_flight = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def __call__(self, method, url, **kwargs):
+        host = url.split('/')[2]
+        with self.lock:
+            self.in_flight[host] += 1
+            self.max_in_flight[host] = max(self.max_in_flight[host], self.in_flight[host])
+        try:
+            response = super().__call__(method, url, **kwargs)
+        finally:
+            with self.lock:
+                self.in_flight[host] -= 1
+        match = re.search(r'/F(\d+)/data$', url)
+        if match is None or response.status_code != 200:
+            return response
+        factor = 1 + int(match.group(1)) % 7 / 10
+        body = json.dumps(scale_numbers(json.loads(response.content), factor)).encode()
+        return build_response(method, url, 200, {'Content-Type': 'application/json'}, body)
+
+
+def get_assignments(pp_file):
+    """(category, security reference, weight, rank) of every assignment of every taxonomy"""
+    assignments = dict()
+    for kind in taxonomies:
+        taxonomy = pp_file.add_taxonomy(kind)
+        assignments[kind] = sorted(
+            (classification.findtext('name'), assignment.find('investmentVehicle').get('reference'),
+             assignment.findtext('weight'), assignment.findtext('rank'))
+            for classification in taxonomy.iter('classification')
+            for assignment in classification.find('assignments'))
+    return assignments
+
+
+class ConcurrentFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        write_pp_file('pp.xml', securities=SECURITIES, prices_per_security=5)
+
+    def tearDown(self):
+        ClassificationStore.close()
+        if Isin2secid.connection is not None:
+            Isin2secid.connection.close()
+            Isin2secid.connection = None
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def classify(self, workers):
+        """assignments of a run with empty caches, and the backend it used"""
+        for path in ('classifications.sqlite', 'isin2secid.sqlite', 'secid2fc.json'):
+            if os.path.exists(path):
+                os.remove(path)
+        BearerToken.tokens = dict()
+        Secid2fc.mapping = LRUCache()
+        Isin2secid.load_cache()
+        ClassificationStore.open()
+        backend = StubBackend()
+        Transport.configure(concurrency=HOST_CONCURRENCY, rate_limit=0, backend=backend, retries=0)
+        pp_file = PortfolioPerformanceFile('pp.xml', 'de', workers)
+        self.assertEqual(len(pp_file.get_securities()), SECURITIES)
+        return get_assignments(pp_file), backend
+
+    def test_concurrent_output_equals_serial_output(self):
+        serial, _ = self.classify(1)
+        concurrent, backend = self.classify(WORKERS)
+        self.assertEqual(concurrent, serial)
+        self.assertTrue(all(serial.values()))
+        # the funds got different weights, so a mix-up would have shown
+        self.assertGreater(len({weight for _, _, weight, _ in serial['Sector']}), SECURITIES)
+        # the workers outnumber the requests allowed per host
+        self.assertLessEqual(max(backend.max_in_flight.values()), HOST_CONCURRENCY)
+        self.assertGreater(max(backend.max_in_flight.values()), 1)
+
+
+class HostLimiterTest(unittest.TestCase):
+
+    def run_threads(self, limiter, threads, hold):
+        in_flight = [0, 0]
+        lock = threading.Lock()
+
+        def request():
+            with limiter:
+                with lock:
+                    in_flight[0] += 1
+                    in_flight[1] = max(in_flight)
+                time.sleep(hold)
+                with lock:
+                    in_flight[0] -= 1
+
+        workers = [threading.Thread(target=request) for _ in range(threads)]
+        start = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return in_flight[1], time.monotonic() - start
+
+    def test_concurrency_cap(self):
+        most, _ = self.run_threads(HostLimiter(concurrency=3, rate_limit=0), threads=12, hold=0.05)
+        self.assertEqual(most, 3)
+
+    def test_rate_cap(self):
+        rate = 50
+        _, elapsed = self.run_threads(HostLimiter(concurrency=20, rate_limit=rate), threads=20, hold=0)
+        # the first request goes at once, the others one interval apart
+        self.assertGreaterEqual(elapsed, (20 - 1) / rate * 0.95)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""the --stream path writes the same file as the in-memory one, in plain and zipped xml
+
+python -m unittest discover -s test   (or python -m pytest test), from the install directory
+"""
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+import zipfile
+
+from benchmarks.synthetic import write_pp_file
+from src.components.bearer_token import BearerToken
+from src.components.classification_store import ClassificationStore
+from src.components.classifier import PortfolioPerformanceFile
+from src.components.file_format import detect_format, ZIPPED_XML, ZIP_ENTRY
+from src.components.isin2secid import Isin2secid
+from src.components.secid2fc import Secid2fc
+from src.components.streaming import StreamingPortfolioPerformanceFile
+from src.components.transport import Transport
+from src.utils.lru import LRUCache
+from src.utils.taxonomies import taxonomies
+from test_taxonomy_update import ScaledBackend, get_assignments_by_security
+
+SECURITIES = 8
+CHANGED = 3
+
+
+def read_content(path):
+    """the xml of a plain or zipped file"""
+    if detect_format(path) == ZIPPED_XML:
+        with zipfile.ZipFile(path) as archive:
+            return archive.read(ZIP_ENTRY)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def get_content(path):
+    """the file without its taxonomies, and the taxonomies without their random ids
+
+    The taxonomies added by a run get new ids, the same file classified twice differs by them only.
+    """
+    root = ET.fromstring(read_content(path))
+    section = root.find('taxonomies')
+    root.remove(section)
+    found = dict()
+    for taxonomy in section:
+        categories = sorted((classification.findtext('name'), classification.findtext('color'))
+                            for classification in taxonomy.iter('classification'))
+        found[taxonomy.findtext('root/id')] = (taxonomy.findtext('name'), categories,
+                                               get_assignments_by_security(taxonomy))
+    return ET.tostring(root), found
+
+
+class StreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        write_pp_file('pp.xml', securities=SECURITIES, prices_per_security=5)
+
+    def tearDown(self):
+        ClassificationStore.close()
+        if Isin2secid.connection is not None:
+            Isin2secid.connection.close()
+            Isin2secid.connection = None
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def classify(self, input_file, output_file, stream, factors=None):
+        """classify the file with every taxonomy and empty caches, in memory or streamed"""
+        for path in ('classifications.sqlite', 'isin2secid.sqlite', 'secid2fc.json'):
+            if os.path.exists(path):
+                os.remove(path)
+        BearerToken.tokens = dict()
+        Secid2fc.mapping = LRUCache()
+        Isin2secid.load_cache()
+        ClassificationStore.open()
+        Transport.configure(rate_limit=0, backend=ScaledBackend(factors), retries=0)
+        file_class = StreamingPortfolioPerformanceFile if stream else PortfolioPerformanceFile
+        pp_file = file_class(input_file, 'de', 1)
+        self.assertEqual(len(pp_file.get_securities()), SECURITIES)
+        for kind in taxonomies:
+            pp_file.add_taxonomy(kind)
+        pp_file.write_xml(output_file)
+
+    def test_stream_output_equals_dom_output(self):
+        self.classify('pp.xml', 'dom.xml', stream=False)
+        self.classify('pp.xml', 'stream.xml', stream=True)
+        dom_rest, dom_taxonomies = get_content('dom.xml')
+        stream_rest, stream_taxonomies = get_content('stream.xml')
+        self.assertEqual(stream_rest, dom_rest)
+        self.assertEqual(stream_taxonomies, dom_taxonomies)
+        self.assertEqual(len(stream_taxonomies), len(taxonomies))
+
+    def test_restream_splices_the_taxonomies(self):
+        self.classify('pp.xml', 'first.xml', stream=True)
+        self.classify('first.xml', 'dom.xml', stream=False, factors={CHANGED: 1.5})
+        self.classify('first.xml', 'stream.xml', stream=True, factors={CHANGED: 1.5})
+        # the taxonomies were updated in place with their ids, both outputs are the same file
+        self.assertEqual(ET.canonicalize(from_file='stream.xml'), ET.canonicalize(from_file='dom.xml'))
+        self.assertNotEqual(get_content('stream.xml')[1], get_content('first.xml')[1])
+
+        # only the bytes of the taxonomies section were replaced
+        first = read_content('first.xml')
+        stream = read_content('stream.xml')
+        start = first.index(b'<taxonomies>')
+        end = first.rindex(b'</taxonomies>') + len(b'</taxonomies>')
+        self.assertEqual(stream[:start], first[:start])
+        self.assertEqual(stream[len(stream) - (len(first) - end):], first[end:])
+
+    def test_zipped_round_trip(self):
+        with zipfile.ZipFile('pp.portfolio', 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.write('pp.xml', ZIP_ENTRY)
+        self.classify('pp.xml', 'plain.xml', stream=False)
+        for stream in (False, True):
+            output_file = f"classified-{stream}.portfolio"
+            self.classify('pp.portfolio', output_file, stream=stream)
+            self.assertEqual(detect_format(output_file), ZIPPED_XML)
+            self.assertEqual(get_content(output_file), get_content('plain.xml'))
+            # and it is read back like any zipped file
+            self.classify(output_file, 'again.portfolio', stream=stream)
+            self.assertEqual(get_content('again.portfolio'), get_content(output_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
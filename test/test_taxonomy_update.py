@@ -0,0 +1,166 @@
+"""a classified file classified again keeps its taxonomies and only updates what changed
+
+python -m unittest discover -s test   (or python -m pytest test), from the install directory
+"""
+import json
+import os
+import re
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from benchmarks.synthetic import SyntheticBackend, write_pp_file
+from src.components.bearer_token import BearerToken
+from src.components.classification_store import ClassificationStore
+from src.components.classifier import PortfolioPerformanceFile, get_security_xpath
+from src.components.isin2secid import Isin2secid
+from src.components.replay import build_response
+from src.components.secid2fc import Secid2fc
+from src.components.transport import Transport
+from src.utils.lru import LRUCache
+from src.utils.taxonomies import taxonomies
+
+SECURITIES = 8
+CHANGED = 3
+
+
+def scale_numbers(value, factor):
+    if isinstance(value, dict):
+        return {key: scale_numbers(item, factor) for key, item in value.items()}
+    if isinstance(value, list):
+        return [scale_numbers(item, factor) for item in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value * factor
+    return value
+
+
+class ScaledBackend(SyntheticBackend):
+    """SyntheticBackend whose SAL answers of a fund are scaled by its factor, 1 by default"""
+
+    def __init__(self, factors=None):
+        super().__init__()
+        self.factors = factors or dict()
+
+    def __call__(self, method, url, **kwargs):
+        response = super().__call__(method, url, **kwargs)
+        match = re.search(r'/F(\d+)/data$', url)
+        if match is None or response.status_code != 200 or int(match.group(1)) not in self.factors:
+            return response
+        body = json.dumps(scale_numbers(json.loads(response.content), self.factors[int(match.group(1))])).encode()
+        return build_response(method, url, 200, {'Content-Type': 'application/json'}, body)
+
+
+def get_classifier_taxonomies(path):
+    """the taxonomies of the file by root id, the user ones left out"""
+    return {taxonomy.findtext('root/id'): taxonomy for taxonomy in ET.parse(path).getroot().find('taxonomies')
+            if taxonomy.findtext('root/id') is not None}
+
+
+def get_categories(taxonomy):
+    """(id, color) of every category of a taxonomy by name"""
+    return {classification.findtext('name'): (classification.findtext('id'), classification.findtext('color'))
+            for classification in taxonomy.iter('classification')}
+
+
+def get_assignments_by_security(taxonomy):
+    """(category, weight, rank) of the assignments of a taxonomy by security reference"""
+    assignments = dict()
+    for classification in taxonomy.iter('classification'):
+        for assignment in classification.find('assignments'):
+            reference = assignment.find('investmentVehicle').get('reference')
+            assignments.setdefault(reference, set()).add(
+                (classification.findtext('name'), assignment.findtext('weight'), assignment.findtext('rank')))
+    return assignments
+
+
+class TaxonomyUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        write_pp_file('pp.xml', securities=SECURITIES, prices_per_security=5)
+
+    def tearDown(self):
+        ClassificationStore.close()
+        if Isin2secid.connection is not None:
+            Isin2secid.connection.close()
+            Isin2secid.connection = None
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def classify(self, input_file, output_file, factors=None):
+        """classify the file with every taxonomy and empty caches"""
+        for path in ('classifications.sqlite', 'isin2secid.sqlite', 'secid2fc.json'):
+            if os.path.exists(path):
+                os.remove(path)
+        BearerToken.tokens = dict()
+        Secid2fc.mapping = LRUCache()
+        Isin2secid.load_cache()
+        ClassificationStore.open()
+        Transport.configure(rate_limit=0, backend=ScaledBackend(factors), retries=0)
+        pp_file = PortfolioPerformanceFile(input_file, 'de', 1)
+        self.assertEqual(len(pp_file.get_securities()), SECURITIES)
+        for kind in taxonomies:
+            pp_file.add_taxonomy(kind)
+        pp_file.write_xml(output_file)
+
+    def test_unchanged_rerun_gives_identical_output(self):
+        self.classify('pp.xml', 'first.xml')
+        self.classify('first.xml', 'second.xml')
+        with open('first.xml', 'rb') as first, open('second.xml', 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+
+    def test_ids_and_colors_are_kept(self):
+        self.classify('pp.xml', 'first.xml')
+        self.classify('first.xml', 'second.xml', {CHANGED: 1.5})
+        first = get_classifier_taxonomies('first.xml')
+        second = get_classifier_taxonomies('second.xml')
+        self.assertEqual(len(first), len(taxonomies))
+        self.assertEqual(first.keys(), second.keys())
+        for root_id, taxonomy in first.items():
+            self.assertEqual(second[root_id].findtext('id'), taxonomy.findtext('id'))
+            categories = get_categories(second[root_id])
+            for name, id_color in get_categories(taxonomy).items():
+                if name in categories:
+                    self.assertEqual(categories[name], id_color)
+
+    def test_only_changed_assignments_are_replaced(self):
+        self.classify('pp.xml', 'first.xml')
+        self.classify('first.xml', 'second.xml', {CHANGED: 1.5})
+        first = get_classifier_taxonomies('first.xml')
+        second = get_classifier_taxonomies('second.xml')
+        changed_kinds = 0
+        for root_id, taxonomy in first.items():
+            before = get_assignments_by_security(taxonomy)
+            after = get_assignments_by_security(second[root_id])
+            self.assertEqual(before.keys(), after.keys())
+            changed = {reference for reference in before if before[reference] != after[reference]}
+            self.assertLessEqual(changed, {get_security_xpath(CHANGED)})
+            changed_kinds += len(changed)
+        # the asset types are not scaled by the long equity share, the other kinds changed
+        self.assertGreaterEqual(changed_kinds, len(taxonomies) - 1)
+
+    def test_user_taxonomy_with_the_same_name_is_left_alone(self):
+        tree = ET.parse('pp.xml')
+        user_taxonomy = ET.fromstring(
+            "<taxonomy><id>user-taxonomy</id><name>Sector</name><root><id>user-root</id><name>Sector</name>"
+            "<color>#000000</color><children><classification><id>user-category</id><name>Mine</name>"
+            "<color>#ffffff</color><parent reference=\"../../..\"/><children/><assignments/><weight>0</weight>"
+            "<rank>1</rank></classification></children><assignments/><weight>10000</weight><rank>0</rank></root>"
+            "</taxonomy>")
+        tree.getroot().find('taxonomies').append(user_taxonomy)
+        tree.write('pp.xml', encoding='UTF-8', xml_declaration=True)
+
+        self.classify('pp.xml', 'first.xml')
+        self.classify('first.xml', 'second.xml', {CHANGED: 1.5})
+        for path in ('first.xml', 'second.xml'):
+            sectors = [taxonomy for taxonomy in ET.parse(path).getroot().find('taxonomies')
+                       if taxonomy.findtext('name') == 'Sector']
+            self.assertEqual(len(sectors), 2)
+            self.assertEqual(ET.tostring(sectors[0]), ET.tostring(user_taxonomy))
+            self.assertGreater(len(get_assignments_by_security(sectors[1])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()